@@ -4,24 +4,471 @@ logic regarding statistics occurs here.
 """
 
 from game import games, team_games
-from player import players, player_names
-from tinydb import TinyDB
-from nicegui import ui
+from player import players, player_names, players_by_name, pairs, ratings, roster, sync_roster, PairCounts, PairRow
+from nicegui import ui, run
 from utils import ratio_safe, CallLater
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+import asyncio
+from types import MappingProxyType
+import json
 import os
+import pickle
+import numpy as np
+import storage
+import metrics
+from match_index import MatchIndex, timestamp
+from rating import Ratings
+from rollup import DailyRollup
+from seasons import past_seasons, add_totals, empty_totals, totals_of
+from datetime import datetime, timedelta
 
 db = None
+db_path = None
+log_indexes = {} # Game name -> MatchIndex of its match history, built on first use
+stats_version = 0 # Bumped whenever the player stats change
+snapshot = None   # Snapshot of the stats at some version, see current()
+rollup = DailyRollup(len(players)) # Wins/losses per player per day, for the Win Rate Over Time chart
+stats_lock = asyncio.Lock() # Held while the stats are rebuilt in the background, or matches written
 
 # Load a reference to the database
+@metrics.instrumented('load_db')
 def load_db(path):
-    global db
-    db = TinyDB(path)
+    open_db(path)
+    rebuild()
 
-def get_teammate_series(player):
+def open_db(path):
+    '''
+    Opens the database without building the stats, for when they get
+    built in the background, see rebuild_in_background().
+    '''
+    global db, db_path
+    db = storage.open_db(path)
+    db_path = path
+    log_indexes.clear()
+
+def read_tables(source=None):
+    source = db if source is None else source # An empty TinyDB is falsy
+    with storage.write_lock:
+        return {game.name: source.table(game.name).all() for game in games}
+
+def get_player(name):
+    return players_by_name.get(name)
+
+def fold_match(match):
+    '''
+    Adds a match to the counters of the players that took part in it,
+    without touching their rankings. Returns the players that changed.
+    '''
+    if match.get('ffa'):
+        return [] # Free-for-all games aren't tracked in the player stats
+    rollup.add(match, players_by_name)
+    affected = [get_player(name) for name in match['team1'] + match['team2']]
+    affected = [p for p in affected if p is not None]
+    for player in affected:
+        player.apply(match)
+    return affected
+
+def apply_match(match):
+    '''
+    Folds a newly inserted match into the stats of the players that took
+    part in it. This only touches the players on the two teams, so it
+    doesn't matter how long the match history gets.
+    Returns the list of players whose stats changed.
+    '''
+    global stats_version
+    affected = fold_match(match)
+    ratings.apply(match)
+    for player in affected:
+        player.rank()
+        player.publish()
+    stats_version += 1
+    return affected
+
+def update_roster():
+    '''
+    Call after changing the roster (see roster.py): makes room for new
+    players and shows everyone under their current name.
+    '''
+    global stats_version
+    sync_roster()
+    rollup.grow(len(players))
+    for player in players:
+        player.derive()
+        player.publish()
+    stats_version += 1
+
+async def change_roster(change, *args):
+    '''
+    Makes a change to the roster, e.g. `await change_roster(roster.add, name)`,
+    and saves it. Waits for a rebuild in the background to finish first,
+    since that one works from the roster as it was when it started.
+    '''
+    async with stats_lock:
+        result = change(*args)
+        roster.save()
+        update_roster()
+    return result
+
+def fold_all(tables):
+    '''
+    Throws away all the player stats and builds them from `tables` (the
+    list of matches of every game, keyed by game name). Every table is
+    only walked once and each match is handed to the players in it, so
+    the cost depends on the number of matches and not on the size of
+    the roster.
+    '''
+    for player in players:
+        player.reset()
+    rollup.reset(len(players))
+    for matches in tables.values():
+        for match in matches:
+            fold_match(match)
+    ratings.replay(tables)
+    for player in players:
+        player.rank()
+
+@metrics.instrumented('rebuild')
+def rebuild():
+    '''
+    Throws away all the player stats and rebuilds them from the database.
+    '''
+    global stats_version
+    fold_all(read_tables())
+    for player in players:
+        player.publish()
+    stats_version += 1
+
+def player_state(player):
+    '''
+    Everything about a player that the stats are made of.
+    '''
+    return {k: v for k, v in vars(player).items() if k not in ('name', 'index', 'subscribers', 'published')}
+
+# Everyone's stats, as sent back by compute_stats()
+StatsState = namedtuple('StatsState', ['players', 'pairs', 'ratings', 'rollup'])
+
+CHECKPOINT_VERSION = 1 # Bump whenever what goes into a StatsState changes
+
+def checkpoint_path(path):
+    '''
+    Where the stats checkpoint of the database at `path` is kept, e.g.
+    `data/database.stats.pickle` for `data/database.json`.
+    '''
+    return os.path.splitext(path)[0] + '.stats.pickle'
+
+def table_marks(tables):
+    '''
+    The highest doc id and the number of matches of every table, which is
+    what a checkpoint remembers about the database it was made from.
+    '''
+    return {name: (max((match.doc_id for match in matches), default=0), len(matches)) for name, matches in tables.items()}
+
+def read_checkpoint(path, k, seasons_path, entries):
+    '''
+    The checkpoint of the database at `path`, or None if there is none or
+    it was made with other settings, another roster or an older version
+    of the stats.
+    '''
+    try:
+        with open(checkpoint_path(path), 'rb') as f:
+            checkpoint = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        return None
+    if (checkpoint['k'], checkpoint['seasons'], checkpoint['roster']) != (k, seasons_path, entries):
+        return None
+    return checkpoint
+
+def write_checkpoint(path, state, marks, k, seasons_path, entries):
+    temp_path = checkpoint_path(path) + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump({
+                'version': CHECKPOINT_VERSION,
+                'k': k,
+                'seasons': seasons_path,
+                'roster': entries,
+                'marks': marks,
+                'state': state,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, checkpoint_path(path))
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path) # Don't leave half a checkpoint behind on a full disk
+        raise
+
+def newer_matches(tables, marks):
+    '''
+    The matches inserted since a checkpoint with the given marks was made,
+    or None if any of the matches it has seen were removed since (e.g. by
+    split_db.py), in which case the stats have to be built from scratch.
+    Matches fixed up in place can't be told apart, so rebuild after that
+    (POST /api/rebuild doesn't use the checkpoint).
+    '''
+    newer = []
+    for name, matches in tables.items():
+        last, count = marks.get(name, (0, 0))
+        if sum(1 for match in matches if match.doc_id <= last) != count:
+            return None
+        newer += sorted((match for match in matches if match.doc_id > last), key=lambda match: match.doc_id)
+    return newer
+
+def stats_state():
+    return StatsState(
+        players=[player_state(player) for player in players],
+        pairs=pairs,
+        ratings=vars(ratings),
+        rollup=vars(rollup),
+    )
+
+def compute_stats(path, k, seasons_path, entries, full=True):
+    '''
+    Builds the stats from the database at `path` and returns them as a
+    StatsState. This runs in a worker process (see rebuild_in_background()),
+    so the stats it overwrites along the way are the worker's own copy.
+    The worker reads the database itself, as handing it hundreds of
+    thousands of matches from the server would hold up the event loop.
+
+    Unless `full` is set, it starts from the checkpoint next to the
+    database and only folds in the matches inserted since. Either way a
+    new checkpoint is written for the next time.
+    '''
+    ratings.k = k
+    if past_seasons.path != seasons_path:
+        past_seasons.load(seasons_path)
+    if roster.entries != entries:
+        roster.restore(entries)
+        sync_roster()
+    # Not closed, as closing the append-only log compacts it, which is up to the server
+    tables = read_tables(storage.open_db(path))
+    checkpoint = None if full else read_checkpoint(path, k, seasons_path, entries)
+    newer = None if checkpoint is None else newer_matches(tables, checkpoint['marks'])
+    if newer is None:
+        fold_all(tables)
+    else:
+        restore_stats(checkpoint['state'])
+        for match in newer:
+            affected = fold_match(match)
+            ratings.apply(match)
+            for player in affected:
+                player.rank()
+    state = stats_state()
+    try:
+        write_checkpoint(path, state, table_marks(tables), k, seasons_path, entries)
+    except OSError as e: # The stats are fine, only the next start will be slower
+        print(f'Could not write the stats checkpoint: {e}')
+    return state
+
+def restore_stats(state):
+    for player, fields in zip(players, state.players):
+        vars(player).update(fields)
+    vars(pairs).update(vars(state.pairs))
+    vars(ratings).update(state.ratings)
+    vars(rollup).update(state.rollup)
+
+def swap_stats(state):
+    '''
+    Replaces everyone's stats with the ones in `state` in one go. Nothing
+    in here awaits, so no client ever sees half of the old stats and half
+    of the new ones.
+    '''
+    global stats_version
+    restore_stats(state)
+    for player in players:
+        player.publish()
+    # The stats were rebuilt from the database as it is now (e.g. with
+    # matches fixed up by hand), so the log indexes get rebuilt from it too
+    log_indexes.clear()
+    stats_version += 1
+
+@metrics.instrumented('load_checkpoint')
+def load_checkpoint():
+    '''
+    Shows the stats from the checkpoint next to the database, if there is
+    one that fits, until the rebuild at startup has caught up with the
+    matches since. Returns whether there was one.
+    '''
+    checkpoint = read_checkpoint(db_path, ratings.k, past_seasons.path, roster.entries)
+    if checkpoint is not None:
+        swap_stats(checkpoint['state'])
+    return checkpoint is not None
+
+async def rebuild_in_background(full=True):
+    '''
+    Rebuilds the stats from the database in a worker process. Until the
+    new stats are swapped in, everyone keeps seeing the previous ones and
+    the server keeps serving them. Submissions still get queued in the
+    meantime; writer.py waits for the swap before writing them.
+    With `full` unset only the matches since the last checkpoint are
+    folded in, see compute_stats().
+    '''
+    async with stats_lock:
+        with metrics.timed('rebuild_background'):
+            state = await run.cpu_bound(compute_stats, db_path, ratings.k, past_seasons.path, roster.entries, full)
+        if state is not None: # None if the server is shutting down
+            swap_stats(state)
+
+@metrics.instrumented('consistency_check')
+def check_consistency():
+    '''
+    Rebuilds every player from scratch and compares the result with the
+    incrementally updated stats. Returns the names of the players that
+    had drifted (the rebuilt stats are kept either way).
+    '''
+    global stats_version
+    before = {player.name: deepcopy(player_state(player)) for player in players}
+    pairs_before = pairs.copy()
+    for player in players:
+        player.refresh()
+        player.publish()
+    stats_version += 1
+    row = lambda counts, player: [getattr(counts, field)[player.index].tolist() for field in PairCounts.fields]
+    return [
+        player.name for player in players
+        if player_state(player) != before[player.name] or row(pairs, player) != row(pairs_before, player)
+    ]
+
+# The stats of a player as of some snapshot
+PlayerStats = namedtuple('PlayerStats', [
+    'name', 'wins', 'losses', 'matches', 'perfects', 'games',
+    'games_with', 'wins_with', 'losses_with', 'games_against', 'wins_against', 'losses_against',
+    'win_rate', 'points_per_game', 'difference_per_game', 'best_position',
+    'best_mate_str', 'worst_mate_str', 'nemesis_str', 'antinemesis_str', 'ratings', 'rating', 'career',
+])
+
+TOP_TEAMS = 20 # Teams shown in the Team Ratings chart
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    return value
+
+class Snapshot:
+    '''
+    A read-only copy of everyone's stats at a given version, shared by
+    every client. Anything derived from it (like the chart series) is
+    cached on it, so it only gets computed once per change to the
+    stats no matter how many people load the page.
+    '''
+
+    def __init__(self, version):
+        self.version = version
+        self.pairs = pairs.copy()
+        self.players = tuple(self.freeze(player) for player in players)
+        self.teams = ratings.top_teams(TOP_TEAMS)
+        self.by_name = {stats.name: stats for stats in self.players}
+        self.cache = {}
+
+    def freeze(self, player):
+        fields = {field: freeze(getattr(player, field)) for field in PlayerStats._fields if field not in PairCounts.fields}
+        # The pair counts are read from this snapshot's copy of the matrices
+        fields.update({field: PairRow(getattr(self.pairs, field)[player.index], player.index) for field in PairCounts.fields})
+        return PlayerStats(**fields)
+
+    def cached(self, key, func):
+        if key not in self.cache:
+            self.cache[key] = func()
+        return self.cache[key]
+
+def current():
+    '''
+    Returns the snapshot of the current stats, taking a new one only if
+    the stats changed since the last one was taken.
+    '''
+    global snapshot
+    if snapshot is None or snapshot.version != stats_version:
+        snapshot = Snapshot(stats_version)
+    return snapshot
+
+def per_snapshot(func):
+    '''
+    Makes `func` read from the current snapshot, and only run once per
+    snapshot for the same arguments. The result is shared between
+    clients, so it must not be modified.
+    '''
+    def wrapper(*args):
+        stats = current()
+        return stats.cached((func.__name__, *args), lambda: func(stats, *args))
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+# Seasons that can be picked in the Season dropdown besides the past ones
+CURRENT_SEASON = 'Current Season'
+ALL_TIME = 'All Time'
+
+# The totals of a player in a past season, or over all of them
+SeasonStats = namedtuple('SeasonStats', ['name', 'wins', 'losses', 'matches', 'perfects', 'games'])
+
+# The periods of the current season that can be picked in the Period
+# dropdown, as the number of days back from today (None is everything)
+PERIODS = {'Whole Season': None, 'Today': 1, 'Last 7 Days': 7, 'Last 30 Days': 30}
+
+def period_start(period):
+    '''
+    The epoch seconds at which `period` starts, or None for the whole
+    season. Periods are made of whole days, so this only changes once a day.
+    '''
+    days = PERIODS.get(period)
+    if days is None:
+        return None
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today - timedelta(days=days - 1)).timestamp()
+
+def under_current_names(totals):
+    '''
+    Merges totals keyed by the names players had at the time into their
+    current name, see roster.py. Names that aren't on the roster stay as
+    they are.
+    '''
+    merged = {}
+    for name, player in totals.items():
+        id = roster.id_of(name)
+        name = name if id is None else roster.name_of(id)
+        if name in merged:
+            add_totals(merged[name], player)
+        else:
+            merged[name] = add_totals(empty_totals(), player)
+    return merged
+
+def range_players(stats, start, end=None):
+    '''
+    The totals of everyone in the current season over the matches played
+    from `start` up to `end` (epoch seconds). The matches are cut out of
+    the time-sorted log indexes with a binary search, so only the ones in
+    the range are looked at.
+    '''
+    totals = under_current_names(totals_of({game.name: log_index(game.name).between(start, end) for game in team_games}))
+    return [SeasonStats(name=player.name, **totals[player.name]) for player in stats.players if player.name in totals]
+
+def season_players(stats, season, start=None):
+    '''
+    The stats of everyone in `season`, with at least the fields of
+    SeasonStats. Past seasons come from their precomputed totals, so
+    their matches are never loaded, and all-time stats add those up
+    with the current season. `start` limits the current season to the
+    matches from then on. Players are listed under their current name,
+    whatever they were called back then.
+    '''
+    if season in (None, CURRENT_SEASON):
+        return stats.players if start is None else range_players(stats, start)
+    if season == ALL_TIME:
+        totals = under_current_names({name: past_seasons.career(name) for name in past_seasons.players()})
+        for player in stats.players:
+            add_totals(totals.setdefault(player.name, empty_totals()), player._asdict())
+    else:
+        segment = past_seasons.get(season)
+        totals = under_current_names(segment.totals) if segment else {}
+    return [SeasonStats(name=name, **player) for name, player in totals.items()]
+
+@per_snapshot
+def get_teammate_series(stats, player):
     '''
     Formats the teammate data so it can be rendered by ui.highchart()
     '''
-    participants = [p for p in players if p != player and player.games_with[p.name] > 0]
+    player = stats.by_name[player.name]
+    participants = [p for p in stats.players if p != player and player.games_with[p.name] > 0]
     series = [
         {
             'name': 'Wins With', 'index': 2, 'color': '#2a9d8f', 'data': [
@@ -36,11 +483,13 @@ def get_teammate_series(player):
     ]
     return series, [p.name for p in participants]
 
-def get_opponent_series(player):
+@per_snapshot
+def get_opponent_series(stats, player):
     '''
     Formats the teammate data so it can be rendered by ui.highchart()
     '''
-    participants = [p for p in players if p != player and player.games_against[p.name] > 0]
+    player = stats.by_name[player.name]
+    participants = [p for p in stats.players if p != player and player.games_against[p.name] > 0]
     series = [
         {
             'name': 'Win Against', 'index': 2, 'color': '#2a9d8f', 'data': [
@@ -55,11 +504,12 @@ def get_opponent_series(player):
     ]
     return series, [p.name for p in participants]
 
-def get_win_rate_series():
+@per_snapshot
+def get_win_rate_series(stats, season=None, start=None):
     '''
     Formats the win rate data so it can be rendered by ui.highchart()
     '''
-    participants = [player for player in players if player.matches > 0]
+    participants = [player for player in season_players(stats, season, start) if player.matches > 0]
     series = [
         {
             'name': game.name,
@@ -74,11 +524,12 @@ def get_win_rate_series():
     ]
     return series, [p.name for p in participants]
 
-def get_win_loss_series():
+@per_snapshot
+def get_win_loss_series(stats, season=None, start=None):
     '''
     Formats the win/loss data so it can be rendered by ui.highchart()
     '''
-    participants = [player for player in players if player.matches > 0]
+    participants = [player for player in season_players(stats, season, start) if player.matches > 0]
     series = [
         {
             'name': 'Wins',
@@ -95,11 +546,12 @@ def get_win_loss_series():
     ]
     return series, [p.name for p in participants]
 
-def get_ppg_series():
+@per_snapshot
+def get_ppg_series(stats, season=None, start=None):
     '''
     Formats the win/loss data so it can be rendered by ui.highchart()
     '''
-    participants = [player for player in players if player.matches > 0]
+    participants = [player for player in season_players(stats, season, start) if player.matches > 0]
     series = [
         {
             'name': game.name,
@@ -114,28 +566,93 @@ def get_ppg_series():
     ]
     return series, [p.name for p in participants]
 
-def get_perfect_series():
+@per_snapshot
+def get_perfect_series(stats):
     '''
     Formats the perfect game data so it can be rendered by ui.highchart()
     '''
     data = []
-    for player in players:
+    for player in stats.players:
         data.append(player.perfects)
     return [{"showInLegend": False, 'data': data}]
 
+@per_snapshot
+def get_rating_series(stats):
+    '''
+    Formats the rating data so it can be rendered by ui.highchart()
+    '''
+    participants = [player for player in stats.players if player.matches > 0]
+    series = [
+        {
+            'name': game.name,
+            'index': game.index,
+            'color': game.color + '99',
+            'pointPadding': game.index / 10,
+            'data': [player.ratings[game.name] for player in participants]
+        } for game in team_games
+    ]
+    return series, [p.name for p in participants]
+
+@per_snapshot
+def get_team_rating_series(stats):
+    '''
+    Formats the team rating data so it can be rendered by ui.highchart()
+    '''
+    colors = {game.name: game.color for game in team_games}
+    series = [
+        {
+            'name': 'Rating',
+            'showInLegend': False,
+            'data': [{'y': rating, 'color': colors[game]} for game, _, rating in stats.teams]
+        },
+    ]
+    return series, [f'{" & ".join(names)} ({game})' for game, names, _ in stats.teams]
+
+@per_snapshot
+def get_win_rate_history_series(stats):
+    '''
+    Formats the win rates over time so they can be rendered by ui.highchart().
+    Reads the daily rollup, so it doesn't matter how many matches there are.
+    '''
+    rates = rollup.win_rates()
+    series = [
+        {
+            'name': player.name,
+            'data': [None if np.isnan(rate) else round(rate, 2) for rate in rates[i]],
+        } for i, player in enumerate(stats.players) if player.matches > 0
+    ]
+    return series, list(rollup.days)
+
 def render_charts():
     '''
     Renders the charts (win rate/win losses) and a dropdown to switch between them.
     Returns a list of `ui.highchart`'s and their associated update methods as tuples.
     '''
     chart_select = ui.select(
-        ['Win Rate', 'Wins/Losses', 'Points Per Game'],
+        ['Win Rate', 'Win Rate Over Time', 'Wins/Losses', 'Points Per Game', 'Ratings', 'Team Ratings'],
         label='Graph',
     ).classes('w-full items-center text-xl')
+    # Only the charts of everyone's totals can show other seasons or part of the current one
+    with ui.row().classes('w-full no-wrap').bind_visibility_from(
+        chart_select, 'value', backward=lambda c: c in ('Win Rate', 'Wins/Losses', 'Points Per Game')
+    ):
+        season_select = ui.select(
+            [CURRENT_SEASON] + past_seasons.names + [ALL_TIME],
+            label='Season',
+            value=CURRENT_SEASON,
+        ).classes('w-full items-center text-xl')
+        period_select = ui.select(
+            list(PERIODS),
+            label='Period',
+            value='Whole Season',
+        ).classes('w-full items-center text-xl').bind_visibility_from(
+            season_select, 'value', backward=lambda s: s == CURRENT_SEASON
+        )
+    selected = lambda: (season_select.value, period_start(period_select.value) if season_select.value == CURRENT_SEASON else None)
 
     # Win rates per game
     with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Win Rate')).classes('w-full'):
-        series, participants = get_win_rate_series()
+        series, participants = get_win_rate_series(*selected())
         win_rates = ui.highchart(
         {
             'title': {'text': 'Win Rates'},
@@ -158,9 +675,28 @@ def render_charts():
         }
     ).classes('w-full h-full')
 
+    # Cumulative win rates at the end of each day
+    with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Win Rate Over Time')).classes('w-full'):
+        series, days = get_win_rate_history_series()
+        win_rate_history = ui.highchart(
+        {
+            'title': {'text': 'Win Rates Over Time'},
+            'chart': {'type': 'line', 'height': '800px', 'zoomType': 'x'},
+            'plotOptions': {
+                'series': {
+                    'connectNulls': True,
+                    'marker': {'enabled': False},
+                },
+            },
+            'xAxis': {'categories': days},
+            'yAxis': {'title': {'text': 'Win Rate (%)'}, 'allowDecimals': True},
+            'series': series,
+        }
+    ).classes('w-full h-full')
+
     # Overall wins/losses
     with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Wins/Losses')).classes('w-full'):
-        series, participants = get_win_loss_series()
+        series, participants = get_win_loss_series(*selected())
         win_loss = ui.highchart(
         {
             'title': {'text': 'Overall Wins/Losses'},
@@ -186,7 +722,7 @@ def render_charts():
     ).classes('w-full h-full')
 
     with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Points Per Game')).classes('w-full'):
-        series, participants = get_ppg_series()
+        series, participants = get_ppg_series(*selected())
         ppg = ui.highchart(
         {
             'title': {'text': 'Points Per Game'},
@@ -209,11 +745,66 @@ def render_charts():
             'series': series,
         }
     ).classes('w-full h-full')
-    return [
-        (win_rates, CallLater(get_win_rate_series)),
-        (win_loss, CallLater(get_win_loss_series)),
-        (ppg, CallLater(get_ppg_series))
+
+    # Elo ratings per game
+    with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Ratings')).classes('w-full'):
+        series, participants = get_rating_series()
+        rating = ui.highchart(
+        {
+            'title': {'text': 'Ratings'},
+            'chart': {'type': 'column'},
+            'plotOptions': {
+                'series': {
+                    'threshold': Ratings.BASE
+                },
+                'column': {
+                    'grouping': False,
+                    'shadow': 'False'
+                }
+            },
+            'xAxis': {'categories': participants},
+            'yAxis': {'title': False, 'allowDecimals': False},
+            'series': series,
+        }
+    ).classes('w-full h-full')
+
+    # Best rated teams
+    with ui.column().bind_visibility_from(chart_select, 'value', backward=chart_lambda('Team Ratings')).classes('w-full'):
+        series, participants = get_team_rating_series()
+        team_rating = ui.highchart(
+        {
+            'title': {'text': 'Team Ratings'},
+            'chart': {'type': 'bar', 'height': '660px'},
+            'plotOptions': {
+                'series': {
+                    'threshold': Ratings.BASE,
+                    'dataLabels': {'enabled': True}
+                },
+            },
+            'xAxis': {'categories': participants},
+            'yAxis': {'title': False, 'allowDecimals': False},
+            'series': series,
+        }
+    ).classes('w-full h-full')
+    seasonal = [
+        (win_rates, lambda: get_win_rate_series(*selected())),
+        (win_loss, lambda: get_win_loss_series(*selected())),
+        (ppg, lambda: get_ppg_series(*selected())),
     ]
+    season_select.on_value_change(lambda: [update_chart(*chart) for chart in seasonal])
+    period_select.on_value_change(lambda: [update_chart(*chart) for chart in seasonal])
+    return seasonal + [
+        (win_rate_history, CallLater(get_win_rate_history_series)),
+        (rating, CallLater(get_rating_series)),
+        (team_rating, CallLater(get_team_rating_series)),
+    ]
+
+def update_chart(chart, update_func):
+    '''
+    Swaps the data of a chart for what `update_func` returns.
+    '''
+    chart.options['series'], chart.options['xAxis']['categories'] = update_func()
+    chart.update()
 
 def render_player_charts(player):
     '''
@@ -289,22 +880,101 @@ def render_player_charts(player):
 def game_lambda(game):
     return lambda g: g == game.name
 
-def player_lambda(player):
-    return lambda p: p == player
-
 def chart_lambda(chart):
     return lambda c: c == chart
 
 
-ignored_fields = ['game', 'ffa']
+# The columns shown in the match history of each kind of game
+log_fields = {
+    False: ['date', 'team1', 'score1', 'team2', 'score2'],
+    True: ['date', 'winner', 'lives'],
+}
+
+LOG_PAGE_SIZE = 100 # Rows the Logs grids fetch from the server at a time
+
+def log_row(match, doc_id):
+    '''
+    Formats a match as a row of the match history grid. Rows carry the
+    document id so the grid can tell them apart, and a numeric timestamp
+    to keep them in order by.
+    '''
+    row = dict(match, id=doc_id)
+    if 'timestamp' not in row: # Older matches only have the date string
+        row['timestamp'] = timestamp(match['date'])
+    return row
+
+def log_index(game_name):
+    '''
+    Returns the index over the match history of a game, building it from
+    the database the first time it's needed. Besides the Logs grids, it's
+    used to find the matches of a time range, see range_players().
+    '''
+    if game_name not in log_indexes:
+        with storage.write_lock:
+            table = db.table(game_name).all()
+        log_indexes[game_name] = MatchIndex((log_row(match, match.doc_id) for match in table), roster)
+    return log_indexes[game_name]
+
+def query_logs(game_name, start, end, sort_model=None, filter_model=None):
+    '''
+    Answers a page request from one of the Logs grids.
+    Returns the rows in the page and the total number of matching rows.
+    '''
+    return log_index(game_name).query(start, end, sort_model, filter_model)
+
+def update_log_index(game_name, transaction):
+    '''
+    Applies a change to the match history of a game to its index.
+    `transaction` uses AG Grid's format: {'add': [rows], 'update': [rows], 'remove': [rows]}.
+    '''
+    if game_name not in log_indexes:
+        return # Will be built from the database once someone asks for it
+    index = log_indexes[game_name]
+    for row in transaction.get('add', []):
+        index.add(row)
+    for row in transaction.get('update', []):
+        index.update(row)
+    for row in transaction.get('remove', []):
+        index.remove(row['id'])
+
+# Asks the server for a page of rows, see the /api/logs endpoint in server.py
+log_datasource = '''{
+    getRows: (params) => {
+        const query = new URLSearchParams({
+            start: params.startRow,
+            end: params.endRow,
+            sort: JSON.stringify(params.sortModel),
+            filter: JSON.stringify(params.filterModel),
+        });
+        fetch('api/logs/' + encodeURIComponent(%s) + '?' + query)
+            .then((response) => response.json())
+            .then((page) => params.successCallback(page.rows, page.total))
+            .catch(() => params.failCallback());
+    }
+}'''
+
+def log_column(field):
+    column = {'headerName': field.upper(), 'field': field, 'sortable': True}
+    if field == 'date':
+        column['filter'] = 'agDateColumnFilter'
+        column['filterParams'] = {
+            'filterOptions': ['equals', 'greaterThan', 'lessThan', 'inRange'],
+            'inRangeInclusive': True,
+        }
+    elif field in ('score1', 'score2', 'lives'):
+        column['filter'] = 'agNumberColumnFilter'
+    else:
+        column['filter'] = 'agTextColumnFilter'
+    return column
+
 def logs():
     '''
     Renders the match history for each game into a table and renders
-    the game dropdown that toggles them.
+    the game dropdown that toggles them. The grids fetch the rows they
+    show from the server page by page, so nothing is sent until a grid
+    is actually looked at. Returns the grids keyed by game name.
     '''
-    global db
-
-    grids = []
+    grids = {}
     # Render game dropdown
     game_select = ui.select(
         [g.name for g in games],
@@ -314,88 +984,155 @@ def logs():
 
     # Render table
     for game in games:
-        table = db.table(game.name).all()
         with ui.column().bind_visibility_from(game_select, 'value', backward=game_lambda(game)).classes('w-full'):
-            if len(table) <= 0:
-                ui.label('No data').classes('text-4xl w-full text-center').style('padding: 100px')
-                continue
-            columnDefs = [{'headerName': key.upper(), 'field': key, 'sortable': True} for key in table[0].keys() if key not in ignored_fields]
-            grids.append(ui.aggrid({
-                'columnDefs': columnDefs,
-                'rowData': table,
+            grids[game.name] = ui.aggrid({
+                'columnDefs': [log_column(field) for field in log_fields[game.ffa]],
+                'rowModelType': 'infinite',
+                'cacheBlockSize': LOG_PAGE_SIZE,
+                'maxBlocksInCache': 10,
                 'rowSelection': 'multiple',
-                'width': '100%'
-            }, theme='alpine').classes('w-full'))
+                'width': '100%',
+                ':getRowId': '(params) => String(params.data.id)',
+                ':datasource': log_datasource % json.dumps(game.name),
+            }, theme='alpine').classes('w-full')
     return grids
 
+def refresh_log(grid):
+    '''
+    Makes a Logs grid re-fetch the pages it has loaded so far.
+    '''
+    grid.run_grid_method('refreshInfiniteCache')
+
 # Some style definitions
 card_classes = 'w-full col-span-1 gap-1 place-content-center bg-primary border-white border-4 rounded-lg'
 icon_classes = 'text-2xl text-white fg-white padding p-1'
 label_classes = 'text-2xl font-bold text-white'
 value_classes = 'text-2xl font-semibold	w-full bg-accent padding p-1 text-center text-white border-white border-4 rounded-lg'
 
+def stat_text(value):
+    return '' if value is None else str(value)
+
 def stat_card(icon, label, player, stat):
     '''
-    Renders an individual statistic card and binds it's value to the
-    associated player object so that we don't need to update the label
-    manually whenever a new game is submitted.
+    Renders an individual statistic card and subscribes it to changes of
+    the associated player stat, so that we don't need to update the label
+    manually whenever a new game is submitted. The player only pushes a
+    new value when it actually changed, see Player.publish().
     '''
-    values = {}
     with ui.card().classes(card_classes):
         ui.icon(icon).classes(icon_classes)
         with ui.row().classes('w-full items-center place-content-center'):
             ui.label(label).classes(label_classes)
         with ui.row().classes('w-full'):
-            values[label] = ui.label().classes(value_classes).bind_text_from(player, stat)
+            value = ui.label(stat_text(getattr(current().by_name[player.name], stat))).classes(value_classes)
+            player.subscribe(stat, value, lambda new_value: value.set_text(stat_text(new_value)))
+
+
+def player_panel(player):
+    '''
+    Renders the stat cards and charts of a single player.
+    Returns the charts so that they can be refreshed later on.
+    '''
+    # Wins/Losses
+    row_classes = 'w-full grid-flow-col'
+    with ui.grid().classes(row_classes):
+        stat_card('arrow_upward', 'Wins', player, 'wins')
+        stat_card('arrow_downward', 'Losses', player, 'losses')
+    # Games/Win Rate
+    with ui.grid().classes(row_classes):
+        stat_card('tag', 'Games', player, 'matches')
+        stat_card('timelapse', 'Win Rate', player, 'win_rate')
+    # Points per game
+    with ui.grid().classes(row_classes):
+        stat_card('calculate', 'Points Per Game (1s/2s/3s)', player, 'points_per_game')
+    with ui.grid().classes(row_classes):
+        stat_card('calculate', 'Point Diff. Per Game (1s/2s/3s)', player, 'difference_per_game')
+    # Elo ratings
+    with ui.grid().classes(row_classes):
+        stat_card('military_tech', 'Rating (1s/2s/3s)', player, 'rating')
+    # Best Position
+    with ui.grid().classes(row_classes):
+        stat_card('group', 'Best Position', player, 'best_position')
+    # Best/Worst Teammate
+    with ui.grid().classes(row_classes):
+        stat_card('handshake', 'Best Teammate', player, 'best_mate_str')
+        stat_card('handshake', 'Worst Teammate', player, 'worst_mate_str')
+    # Nemesis/Anti-nemesis
+    with ui.grid().classes(row_classes):
+        stat_card('bolt', 'Nemesis', player, 'nemesis_str')
+        stat_card('emoji_events', 'Anti-Nemesis', player, 'antinemesis_str')
+    # Lunches
+    with ui.grid().classes(row_classes):
+        stat_card('star', 'Lunches', player, 'perfects')
+    # Wins/Losses over every season
+    with ui.grid().classes(row_classes):
+        stat_card('history', 'Career (All Seasons)', player, 'career')
+    return render_player_charts(player)
+
+
+class PlayerPanels:
+    '''
+    Builds the panel of a player the first time they are picked in the
+    player dropdown instead of building one for everyone up front. The
+    last few panels are kept around (hidden) so that switching back and
+    forth is instant, older ones are deleted.
+    '''
+    CACHE_SIZE = 3 # Panels to keep per client
+
+    def __init__(self, container):
+        self.container = container
+        self.panels = OrderedDict() # Player name -> (column, charts), least recently used first
+
+    def show(self, name):
+        for column, _ in self.panels.values():
+            column.set_visibility(False)
+        player = get_player(name)
+        if player is None:
+            return
+
+        if name in self.panels:
+            self.panels.move_to_end(name)
+        else:
+            with self.container:
+                with ui.column().classes('w-full') as column:
+                    charts = player_panel(player)
+            self.panels[name] = (column, charts)
+            while len(self.panels) > PlayerPanels.CACHE_SIZE:
+                old_name, (old_column, _) = self.panels.popitem(last=False)
+                old_column.delete()
+                self.release(old_name)
+        self.panels[name][0].set_visibility(True)
+
+    def release(self, *names):
+        '''
+        Drops the stat card subscriptions of deleted panels, of the given
+        players or of every panel (once the client is gone).
+        '''
+        for name in names or list(self.panels):
+            player = get_player(name)
+            if player is not None:
+                player.prune()
+
+    @property
+    def charts(self):
+        '''
+        The charts of the panels that currently exist.
+        '''
+        return [chart for _, charts in self.panels.values() for chart in charts]
 
 
 def stats():
     '''
     Renders the stats page, including a player dropdown menu that
-    toggles the stat cards for each player.
+    shows the stat cards of the picked player. Returns the PlayerPanels
+    that keep track of the charts of the panels built so far.
     '''
-
-    charts = []
     with ui.column().classes('w-full gap-5'):
         # Render player dropdown
         player_select = ui.select(
-            player_names,
+            list(player_names),
             label='Player',
         ).classes('w-full items-center text-xl')
-
-        for player in players:
-            with ui.column().bind_visibility_from(player_select, 'value', backward=player_lambda(player.name)).classes('w-full'):
-                # Wins/Losses
-                row_classes = 'w-full grid-flow-col'
-                with ui.grid().classes(row_classes):
-                    stat_card('arrow_upward', 'Wins', player, 'wins')
-                    stat_card('arrow_downward', 'Losses', player, 'losses')
-                # Games/Win Rate
-                with ui.grid().classes(row_classes):
-                    stat_card('tag', 'Games', player, 'matches')
-                    stat_card('timelapse', 'Win Rate', player, 'win_rate')
-                # Points per game
-                with ui.grid().classes(row_classes):
-                    stat_card('calculate', 'Points Per Game (1s/2s/3s)', player, 'points_per_game')
-                with ui.grid().classes(row_classes):
-                    stat_card('calculate', 'Point Diff. Per Game (1s/2s/3s)', player, 'difference_per_game')
-                # Best Position
-                with ui.grid().classes(row_classes):
-                    stat_card('group', 'Best Position', player, 'best_position')
-                # Best/Worst Teammate
-                with ui.grid().classes(row_classes):
-                    best_mate, worst_mate = player.best_mate, player.worst_mate
-                    stat_card('handshake', 'Best Teammate', player, 'best_mate_str')
-                    stat_card('handshake', 'Worst Teammate', player, 'worst_mate_str')
-                # Nemesis/Anti-nemesis
-                with ui.grid().classes(row_classes):
-                    nemesis, antinemesis = player.nemesis, player.antinemesis
-                    stat_card('bolt', 'Nemesis', player, 'nemesis_str')
-                    stat_card('emoji_events', 'Anti-Nemesis', player, 'antinemesis_str')
-                # Lunches
-                with ui.grid().classes(row_classes):
-                    stat_card('star', 'Lunches', player, 'perfects')
-                charts += render_player_charts(player)
-    return charts
-
-
+        panels = PlayerPanels(ui.column().classes('w-full'))
+        player_select.on_value_change(lambda event: panels.show(event.value))
+    return panels
@@ -0,0 +1,46 @@
+'''
+Times NiceGUI's binding refresh step with the stat cards of every player
+rendered a few times over, the way it runs in the background every
+`binding_refresh_interval` while clients are connected. Also times
+pushing the stats of every player to those cards after a change. Run it
+from the repo root:
+
+    python -m benchmarks.bindings
+'''
+
+from time import perf_counter
+
+from nicegui import binding, ui
+
+import analytics
+from player import players
+
+CLIENTS = 5 # Copies of every player panel, as if that many clients had them open
+STEPS = 200
+
+
+if __name__ == '__main__':
+    analytics.load_db('data/database.json')
+    analytics.rebuild()
+
+    for _ in range(CLIENTS):
+        for player in players:
+            with ui.column():
+                analytics.player_panel(player)
+
+    binding._refresh_step() # The first step sets every label
+    start = perf_counter()
+    for _ in range(STEPS):
+        binding._refresh_step()
+    elapsed = perf_counter() - start
+
+    print(f'{len(binding.active_links)} active links')
+    print(f'{elapsed / STEPS * 1000:.3f} ms per refresh step')
+
+    start = perf_counter()
+    for _ in range(STEPS):
+        for player in players:
+            player.published = {} # Pretend every stat changed
+            player.publish()
+    elapsed = perf_counter() - start
+    print(f'{elapsed / STEPS * 1000:.3f} ms to push every stat of every player')
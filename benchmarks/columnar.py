@@ -0,0 +1,50 @@
+'''
+Compares the vectorized stats in columnar.py against the Python loop in
+analytics.rebuild() on synthetic histories. Run it from the repo root:
+
+    python -m benchmarks.columnar [sizes...]
+'''
+
+import sys
+from time import perf_counter
+
+import analytics
+import columnar
+from benchmarks import workload
+from player import player_names
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def fill_db(count):
+    '''
+    Creates an in-memory database with `count` generated matches between
+    the players of the current roster.
+    '''
+    analytics.db = workload.memory_db(workload.generate(count, player_names, seed=count))
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    print(f'{"matches":>9} {"loop (s)":>9} {"convert (s)":>12} {"numpy (s)":>10} {"speedup":>8}')
+    for size in sizes:
+        fill_db(size)
+        _, loop = timed(analytics.rebuild)
+        store, convert = timed(lambda: columnar.ColumnarStore.from_db(analytics.db))
+        totals, vectorized = timed(store.totals)
+
+        # Make sure both agree before bragging about the numbers
+        for i, name in enumerate(store.names):
+            player = analytics.get_player(name)
+            assert player.wins == totals['wins'][i] and player.losses == totals['losses'][i]
+            assert player.perfects == totals['perfects'][i]
+            for game, stats in totals['games'].items():
+                assert abs(player.games[game]['point_difference'] - stats['point_difference'][i]) < 1e-6
+
+        print(f'{size:>9} {loop:>9.3f} {convert:>12.3f} {vectorized:>10.4f} {loop / vectorized:>7.0f}x')
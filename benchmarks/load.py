@@ -0,0 +1,315 @@
+'''
+Load test: a bunch of simulated browsers using the app at once. Each one
+loads the page, connects over socket.io like the real page does, switches
+tabs, picks players and graphs, and every so often fills in the Add form
+and presses Submit, so submissions go through Form.submit() on the server
+exactly like real ones. Every client reloads the page now and then.
+
+By default it starts the server on a generated database (see
+benchmarks/workload.py) in a temporary directory; give it --url to point
+it at one that's already running instead. Run it from the repo root:
+
+    python -m benchmarks.load [--clients 20] [--duration 60] [--submit-every 6] [--matches 2000]
+    python -m benchmarks.load --url http://localhost:6969/topspin
+
+It reports the 50th/99th percentiles of how long the page takes to load
+and how long a submission takes to come back as "Submitted.", plus how
+late the server's event loop wakes up (the `loop_lag` stage of /metrics).
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import uuid
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import aiohttp
+import socketio
+
+from benchmarks import workload
+from game import games, team_games, ffa_games
+from metrics import BUCKETS
+
+PORT = 6979
+TABS = ['Graphs', 'Players', 'Logs', 'Add']
+SUBMIT_TIMEOUT = 10 # Seconds to wait for a submission to be acknowledged
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def bucket_percentile(before, after, q):
+    '''
+    The upper bound of the bucket the q-th percentile falls in, from two
+    readings of a stage in /metrics?format=json.
+    '''
+    counts = [after['buckets'][str(b)] - before.get('buckets', {}).get(str(b), 0) for b in BUCKETS + [float('inf')]]
+    if not counts[-1]:
+        return float('nan')
+    for bound, count in zip(BUCKETS + [float('inf')], counts):
+        if count >= q * counts[-1]:
+            return bound
+
+
+def parse_page(html):
+    '''
+    The client id, path prefix and elements of a page, from the bits of
+    the template that the browser would read them from.
+    '''
+    client_id = re.search(r"'client_id': '([^']+)'", html).group(1)
+    prefix = re.search(r'prefix: "([^"]*)"', html).group(1)
+    raw = re.search(r'parseElements\(String\.raw`(.*?)`\)', html, re.S).group(1)
+    for escaped, char in [('&#36;', '$'), ('&#96;', '`'), ('&gt;', '>'), ('&lt;', '<'), ('&amp;', '&')]:
+        raw = raw.replace(escaped, char)
+    elements = {int(id): {**element, 'id': int(id)} for id, element in json.loads(raw).items()}
+    return client_id, prefix, elements
+
+
+class Page:
+    '''
+    The elements of a loaded page that the simulated client uses, found
+    by their labels and by the order Form.render() creates them in.
+    '''
+
+    def __init__(self, elements) -> None:
+        self.elements = elements
+        ordered = [elements[id] for id in sorted(elements)]
+        selects = [e for e in ordered if e['tag'] == 'nicegui-select']
+        labelled = lambda label: [e for e in selects if e['props'].get('label') == label]
+
+        self.tabs = next(e for e in ordered if e['tag'] == 'q-tabs')
+        self.browsing = labelled('Graph') + labelled('Season') + labelled('Period') + labelled('Player')[:1]
+        self.game_select = labelled('Gamemode')[-1] # The first one is in the Players tab
+        self.submit_button = next(e for e in ordered if e['tag'] == 'q-btn' and e['props'].get('label') == 'Submit')
+
+        fields = [e for e in ordered if e['id'] > self.game_select['id'] and e['tag'] in ('nicegui-select', 'q-input')]
+        self.forms = {}
+        for game in team_games:
+            teams = []
+            for _ in range(2):
+                teams.append((fields[:game.ppt], fields[game.ppt]))
+                fields = fields[game.ppt + 1:]
+            self.forms[game.name] = teams
+        for game in ffa_games:
+            self.forms[game.name] = (fields[0], fields[1])
+            fields = fields[2:]
+        self.player_names = [o['label'] for o in self.forms[team_games[0].name][0][0][0]['props']['options']]
+
+    @staticmethod
+    def listener(element, event):
+        return next(e['listener_id'] for e in element['events'] if e['type'] == event)
+
+
+class SimulatedClient:
+
+    def __init__(self, base_url, session, results, args, seed) -> None:
+        self.base_url = base_url
+        self.session = session
+        self.results = results
+        self.args = args
+        self.rng = random.Random(seed)
+        self.sio = None
+        self.notifications = asyncio.Queue()
+
+    async def load(self):
+        start = perf_counter()
+        async with self.session.get(self.base_url + '/') as response:
+            html = await response.text()
+            response.raise_for_status()
+        self.results['page_load'].append(perf_counter() - start)
+
+        self.client_id, prefix, elements = parse_page(html)
+        self.page = Page(elements)
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on('notify', self.notifications.put_nowait)
+        url = urlsplit(self.base_url)
+        await self.sio.connect(
+            f'{url.scheme}://{url.netloc}?client_id={self.client_id}',
+            socketio_path=f'{prefix}/_nicegui_ws/socket.io',
+            transports=['websocket'],
+        )
+        if not await self.sio.call('handshake', {'client_id': self.client_id, 'tab_id': str(uuid.uuid4())}):
+            raise RuntimeError(f'Handshake failed for {self.client_id}')
+
+    async def close(self):
+        if self.sio is not None:
+            await self.sio.disconnect()
+
+    async def send(self, element, event, *args):
+        await self.sio.emit('event', {
+            'id': element['id'],
+            'client_id': self.client_id,
+            'listener_id': Page.listener(element, event),
+            'args': [json.dumps(arg) for arg in args],
+        })
+        self.results['events'] += 1
+
+    async def pick(self, select, label=None):
+        options = select['props']['options']
+        option = next(o for o in options if o['label'] == label) if label else self.rng.choice(options)
+        await self.send(select, 'update:modelValue', option)
+
+    async def browse(self):
+        if self.rng.random() < 0.5:
+            await self.send(self.page.tabs, 'update:modelValue', self.rng.choice(TABS))
+        else:
+            await self.pick(self.rng.choice(self.page.browsing))
+
+    async def submit(self):
+        '''
+        Fills in the Add form with a random match and submits it.
+        '''
+        game = self.rng.choice(games)
+        await self.pick(self.page.game_select, game.name)
+        players = self.rng.sample(self.page.player_names, game.ppt * 2)
+        if game.ffa:
+            winner, lives = self.page.forms[game.name]
+            await self.pick(winner, players[0])
+            await self.send(lives, 'update:modelValue', str(self.rng.randint(*game.bounds)))
+        else:
+            scores = workload.team_score(game, self.rng)
+            for (dropdowns, score), team, points in zip(self.page.forms[game.name], (players[:game.ppt], players[game.ppt:]), scores):
+                for dropdown, name in zip(dropdowns, team):
+                    await self.pick(dropdown, name)
+                await self.send(score, 'update:modelValue', str(int(points)))
+
+        while not self.notifications.empty():
+            self.notifications.get_nowait()
+        start = perf_counter()
+        await self.send(self.page.submit_button, 'click', {})
+        try:
+            while True:
+                notification = await asyncio.wait_for(self.notifications.get(), SUBMIT_TIMEOUT)
+                if notification.get('message') == 'Submitted.':
+                    self.results['submit'].append(perf_counter() - start)
+                    return
+                if notification.get('color') in ('red', 'orange'):
+                    self.results['rejected'] += 1
+                    return
+        except asyncio.TimeoutError:
+            self.results['timeouts'] += 1
+
+    async def run(self, deadline):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp_up))
+        await self.load()
+        next_submit = loop.time() + self.rng.uniform(0, self.args.submit_every)
+        next_reload = loop.time() + self.args.reload_every
+        while loop.time() < deadline:
+            if loop.time() >= next_reload:
+                await self.close()
+                await self.load()
+                next_reload = loop.time() + self.args.reload_every
+                next_submit = max(next_submit, loop.time())
+            if loop.time() >= next_submit:
+                await self.submit()
+                next_submit = loop.time() + self.args.submit_every
+            else:
+                await self.browse()
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+        await self.close()
+
+
+async def read_metrics(session, base_url):
+    async with session.get(base_url + '/metrics', params={'format': 'json'}) as response:
+        return (await response.json())['stages']
+
+
+async def wait_until_up(base_url, timeout=60):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(timeout * 4):
+            try:
+                async with session.get(base_url + '/metrics', params={'format': 'json'}) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f'The server at {base_url} did not come up')
+
+
+def start_server(directory, matches, port):
+    '''
+    Starts server.py on a generated database, returns the process.
+    '''
+    import analytics # Makes sure player.py is imported through analytics first
+    from player import player_names
+
+    db_file = os.path.join(directory, 'database.json')
+    workload.write(workload.generate(matches, player_names), db_file)
+    config = os.path.join(directory, 'load.cfg')
+    with open(config, 'w') as f:
+        f.write(f'[topspin]\ndb_file = {db_file}\nseasons_file = {os.path.join(directory, "seasons.json")}\n'
+                f'port = {port}\nroot_path = /topspin\n')
+    log = open(os.path.join(directory, 'server.log'), 'w')
+    # In its own process group, since the reloader starts the actual server as a child
+    return subprocess.Popen([sys.executable, 'server.py', config], stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+async def load_test(base_url, args):
+    await wait_until_up(base_url)
+    results = {'page_load': [], 'submit': [], 'events': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+    async with aiohttp.ClientSession() as session:
+        before = await read_metrics(session, base_url)
+        deadline = asyncio.get_running_loop().time() + args.duration
+        clients = [SimulatedClient(base_url, session, results, args, seed) for seed in range(args.clients)]
+        for outcome in await asyncio.gather(*(client.run(deadline) for client in clients), return_exceptions=True):
+            if isinstance(outcome, Exception):
+                results['errors'] += 1
+                print(f'Client failed: {outcome!r}')
+        after = await read_metrics(session, base_url)
+    return results, before, after
+
+
+def report(results, before, after, args):
+    ms = lambda seconds: f'{seconds * 1000:>10.1f}'
+    print(f'{args.clients} clients for {args.duration}s, {results["events"]} events sent')
+    print(f'{"":<22}{"count":>7}{"p50 (ms)":>10}{"p99 (ms)":>10}')
+    for name, label in [('page_load', 'page load'), ('submit', 'submit')]:
+        values = results[name]
+        print(f'{label:<22}{len(values):>7}{ms(percentile(values, 0.5))}{ms(percentile(values, 0.99))}')
+    for stage, label in [('submit', 'submit (server)'), ('page_build', 'page build (server)'), ('loop_lag', 'event loop lag')]:
+        if stage in after:
+            count = after[stage]['count'] - before.get(stage, {}).get('count', 0)
+            p50, p99 = (bucket_percentile(before.get(stage, {}), after[stage], q) for q in (0.5, 0.99))
+            print(f'{label:<22}{count:>7}{ms(p50)}{ms(p99)}')
+    print('(the server side ones are the upper bounds of the metrics.BUCKETS they fall in)')
+    print(f'rejected submissions: {results["rejected"]}, timed out: {results["timeouts"]}, failed clients: {results["errors"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run for')
+    parser.add_argument('--submit-every', type=float, default=6,
+                        help='Seconds between submissions of a client (the form refuses more than one every 5s)')
+    parser.add_argument('--think', type=float, default=1, help='Mean seconds between clicks')
+    parser.add_argument('--reload-every', type=float, default=30, help='Seconds between page reloads of a client')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which the clients connect')
+    parser.add_argument('--matches', type=int, default=2000, help='Size of the generated database')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--url', help='Test an already running server instead, e.g. http://localhost:6969/topspin')
+    args = parser.parse_args()
+
+    if args.url:
+        report(*asyncio.run(load_test(args.url.rstrip('/'), args)), args)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            server = start_server(directory, args.matches, args.port)
+            try:
+                report(*asyncio.run(load_test(f'http://127.0.0.1:{args.port}/topspin', args)), args)
+            finally:
+                os.killpg(server.pid, signal.SIGTERM)
+                server.wait()
@@ -0,0 +1,69 @@
+'''
+Measures how much memory a generated match history (see
+benchmarks/workload.py) takes up per match once it's loaded:
+
+- as the documents TinyDB hands out for the tables
+- as the dict rows the Logs index used to keep (the document plus its id
+  and timestamp), not counting the index around them
+- as the MatchIndex the Logs grids and period stats use now, with its
+  MatchRecords and per-player index included
+
+Run it from the repo root:
+
+    python -m benchmarks.memory [matches]
+'''
+
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from tinydb import TinyDB
+
+import analytics
+from benchmarks import workload
+from match_index import MatchIndex
+from player import player_names, roster
+
+SIZE = 1_000_000
+
+
+def allocated(build):
+    '''
+    Builds something and returns it with the number of bytes it holds on to.
+    '''
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def load(db):
+    return {game: db.table(game).all() for game in db.tables()}
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZE
+    with tempfile.TemporaryDirectory() as directory:
+        # Read back from a file so nothing is shared with what generated it
+        path = os.path.join(directory, 'database.json')
+        workload.write(workload.generate(size, player_names), path)
+        db = TinyDB(path, access_mode='r')
+
+        tracemalloc.start()
+        _, documents = allocated(lambda: load(db))
+        _, rows = allocated(lambda: {
+            game: [analytics.log_row(match, match.doc_id) for match in matches] for game, matches in load(db).items()
+        })
+        _, indexes = allocated(lambda: {
+            game: MatchIndex((analytics.log_row(match, match.doc_id) for match in matches), roster)
+            for game, matches in load(db).items()
+        })
+        tracemalloc.stop()
+        db.close()
+
+    print(f'{size} matches')
+    for label, total in [('documents', documents), ('dict rows', rows), ('MatchIndex', indexes)]:
+        print(f'{label:<12}{total / size:>8.0f} bytes/match {total / 2**20:>9.1f} MB')
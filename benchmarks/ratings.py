@@ -0,0 +1,39 @@
+'''
+Times replaying the Elo ratings over synthetic histories (not counting
+reading the matches out of the database), and checks the replay against
+feeding the same matches through Ratings.apply() one at a time like
+submissions do. Run it from the repo root:
+
+    python -m benchmarks.ratings [sizes...]
+'''
+
+import sys
+
+import analytics
+from benchmarks.columnar import fill_db, timed
+from player import ratings
+
+SIZES = [10_000, 100_000, 1_000_000]
+CHECKED = 20_000 # Only the smaller histories are also applied one by one, it's slow
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    print(f'{"matches":>9} {"replay (s)":>11} {"one by one (s)":>15}')
+    for size in sizes:
+        fill_db(size)
+        tables = {game: analytics.db.table(game).all() for game in ratings.games}
+        _, replay = timed(lambda: ratings.replay(tables))
+        incremental = '-'
+        if size <= CHECKED:
+            replayed = ratings.players.copy(), ratings.teams
+            ratings.reset()
+            matches = [match for game in ratings.games for match in tables[game]]
+            matches.sort(key=lambda match: match['date']) # Stable, so same-day matches keep their order per game
+            _, elapsed = timed(lambda: [ratings.apply(match) for match in matches])
+            assert abs(ratings.players - replayed[0]).max() < 1e-6
+            for game, teams in ratings.teams.items():
+                assert teams.keys() == replayed[1][game].keys()
+                assert all(abs(rating - replayed[1][game][team]) < 1e-6 for team, rating in teams.items())
+            incremental = f'{elapsed:.3f}'
+        print(f'{size:>9} {replay:>11.3f} {incremental:>15}')
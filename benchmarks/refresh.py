@@ -0,0 +1,56 @@
+'''
+Times a full stats rebuild with the old per-player table scans against
+the single pass in analytics.rebuild(), for a few roster sizes and match
+counts. Run it from the repo root:
+
+    python -m benchmarks.refresh
+'''
+
+from time import perf_counter
+
+import analytics
+import player
+from benchmarks import workload
+
+MATCH_COUNTS = [500, 1000, 2000, 4000]
+ROSTER_SIZES = [15, 30, 60]
+
+
+def use_roster(size):
+    '''
+    Swaps the roster for `size` made up players.
+    '''
+    names = [f'Player{i:03}' for i in range(size)]
+    player.roster.reset(names)
+    player.ratings.resize(names)
+    analytics.update_roster()
+    return names
+
+
+def fill_db(names, count):
+    '''
+    Creates an in-memory database with `count` generated matches.
+    '''
+    analytics.db = workload.memory_db(workload.generate(count, names, seed=count))
+
+
+def timed(func):
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+
+def per_player_refresh():
+    for p in player.players:
+        p.refresh()
+
+
+if __name__ == '__main__':
+    print(f'{"players":>8} {"matches":>8} {"per-player (s)":>15} {"single pass (s)":>16} {"us/match":>9}')
+    for size in ROSTER_SIZES:
+        names = use_roster(size)
+        for count in MATCH_COUNTS:
+            fill_db(names, count)
+            old = timed(per_player_refresh)
+            new = timed(analytics.rebuild)
+            print(f'{size:>8} {count:>8} {old:>15.3f} {new:>16.3f} {new / count * 1e6:>9.1f}')
@@ -0,0 +1,132 @@
+'''
+Times the operations whose cost grows with the match history, on
+generated databases (see benchmarks/workload.py) of a few sizes:
+
+- loading the database and building the stats (analytics.load_db)
+- refreshing every player from scratch (Player.refresh)
+- building every chart series from a fresh snapshot
+- what a client downloads for the Logs grids (analytics.logs)
+- submitting a match (insert, stats update and log index update)
+
+Run it from the repo root and keep the numbers around to compare
+against after a change:
+
+    python -m benchmarks.suite [--backend json|jsonl|sqlite] [sizes...]
+'''
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import timedelta
+from time import perf_counter
+
+from nicegui import ui
+
+import analytics
+from benchmarks import workload
+from player import players, player_names
+from storage import SQLiteDB
+
+SIZES = [1_000, 10_000, 100_000]
+INSERTS = 50 # Matches submitted to time an insert
+EXTENSIONS = {'json': '.json', 'jsonl': '.jsonl', 'sqlite': '.sqlite'}
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+def write_db(tables, directory, backend):
+    '''
+    Writes the generated matches in the format of the given backend and
+    returns the path to pass to analytics.load_db().
+    '''
+    path = os.path.join(directory, 'database' + EXTENSIONS[backend])
+    if backend == 'sqlite':
+        db = SQLiteDB(path)
+        for game, matches in tables.items():
+            table = db.table(game)
+            with db.connection:
+                for doc_id, match in matches.items():
+                    table._insert(match, int(doc_id))
+        db.close()
+    else:
+        # The append-only log reads its snapshot from the .json file next to it
+        workload.write(tables, os.path.splitext(path)[0] + '.json')
+    return path
+
+
+def build_series():
+    analytics.stats_version += 1 # Forces a new snapshot so nothing comes from the cache
+    for update in [
+        analytics.get_win_rate_series, analytics.get_win_rate_history_series, analytics.get_win_loss_series,
+        analytics.get_ppg_series, analytics.get_rating_series, analytics.get_team_rating_series,
+    ]:
+        update()
+    for player in players:
+        analytics.get_teammate_series(player)
+        analytics.get_opponent_series(player)
+
+
+def logs_payload():
+    '''
+    The bytes sent for the Logs grids when the page loads, plus the first
+    page of rows each grid fetches once it's shown.
+    '''
+    with ui.column():
+        grids = analytics.logs()
+    size = sum(len(json.dumps(grid._props)) for grid in grids.values())
+    for game in grids:
+        rows, total = analytics.query_logs(game, 0, analytics.LOG_PAGE_SIZE)
+        size += len(json.dumps({'rows': rows, 'total': total}))
+    return size
+
+
+def submit(match):
+    '''
+    What Form.submit() does with a match, minus the UI.
+    '''
+    doc_id = analytics.db.table(match['game']).insert(match)
+    analytics.apply_match(match)
+    analytics.update_log_index(match['game'], {'add': [analytics.log_row(match, doc_id)]})
+
+
+def run(size, backend):
+    tables = workload.generate(size, player_names, seed=size)
+    # Submitted after everything else, like new matches are
+    later = workload.START + timedelta(days=366)
+    extra = workload.generate(INSERTS, player_names, seed=-size, days=1, start=later)
+    extra = sorted((match for game in extra.values() for match in game.values()), key=lambda match: match['timestamp'])
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_db(tables, directory, backend)
+        _, load = timed(lambda: analytics.load_db(path))
+        _, refresh = timed(lambda: [player.refresh() for player in players])
+        _, series = timed(build_series)
+        payload = logs_payload()
+        _, inserts = timed(lambda: [submit(match) for match in extra])
+        analytics.db.close()
+    return {
+        'load (s)': load,
+        'refresh (s)': refresh,
+        'series (s)': series,
+        'logs (KB)': payload / 1024,
+        'insert (ms)': inserts / len(extra) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--backend', choices=EXTENSIONS, default='json')
+    args = parser.parse_args()
+
+    columns = None
+    for size in args.sizes:
+        results = run(size, args.backend)
+        if columns is None:
+            columns = list(results)
+            print(f'{"matches":>9}' + ''.join(f'{column:>13}' for column in columns))
+        print(f'{size:>9}' + ''.join(f'{results[column]:>13.3f}' for column in columns))
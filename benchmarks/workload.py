@@ -0,0 +1,98 @@
+'''
+Generates synthetic match histories shaped exactly like the documents
+Form.__call__() writes, for benchmarking at sizes we don't have real data
+for. Every player gets a hidden skill that decides who tends to win, and
+some players show up far more often than others. Scores stay within the
+bounds of each game. Run it from the repo root to write a database:
+
+    python -m benchmarks.workload <matches> <path> [seed]
+'''
+
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from game import games
+
+START = datetime(2024, 1, 1, 12)
+GAME_WEIGHTS = {'Singles': 4, 'Doubles': 10, 'Triples': 1, 'Ping Around The Rosie': 1} # Relative popularity
+
+
+def team_score(game, rng):
+    '''
+    A (winning, losing) score: first to 11, won by 2.
+    '''
+    high = min(game.bounds[1], 11)
+    loser = rng.randint(game.bounds[0], high - 2)
+    if loser == high - 2 and rng.random() < 0.3: # Deuce
+        loser += rng.randint(0, 5)
+        return float(loser + 2), float(loser)
+    return float(high), float(loser)
+
+
+def generate(count, names, seed=0, days=365, start=START):
+    '''
+    Generates `count` matches between `names` over `days` days from
+    `start`, in the per-game layout of the database file:
+    {game: {doc_id: match}}.
+    '''
+    rng = random.Random(seed)
+    skill = {name: rng.gauss(0, 1) for name in names}
+    popularity = list(accumulate(rng.paretovariate(1.5) for _ in names))
+    picked_games = rng.choices(games, [GAME_WEIGHTS.get(game.name, 1) for game in games], k=count)
+    tables = {game.name: {} for game in games}
+    step = days * 86400 / max(count, 1)
+
+    for i, game in enumerate(picked_games):
+        when = start + timedelta(seconds=int(i * step))
+        size = game.ppt * 2 if not game.ffa else min(len(names), rng.randint(3, 6))
+        picked = []
+        while len(picked) < size:
+            picked = list(dict.fromkeys(picked + rng.choices(names, cum_weights=popularity, k=size)))[:size]
+
+        match = {'game': game.name, 'date': when.strftime('%Y-%m-%d %H:%M:%S'), 'timestamp': when.timestamp(), 'ffa': game.ffa}
+        if game.ffa:
+            match['winner'] = max(picked, key=lambda name: skill[name] + rng.gauss(0, 1.5))
+            match['lives'] = float(rng.randint(*game.bounds))
+        else:
+            team1, team2 = picked[:game.ppt], picked[game.ppt:]
+            strength = lambda team: sum(skill[name] for name in team) / len(team) + rng.gauss(0, 1)
+            if strength(team2) > strength(team1):
+                team1, team2 = team2, team1
+            score1, score2 = team_score(game, rng)
+            match.update({'team1': team1, 'score1': score1, 'team2': team2, 'score2': score2})
+        tables[game.name][str(len(tables[game.name]) + 1)] = match
+    return tables
+
+
+def memory_db(tables):
+    '''
+    An in-memory TinyDB holding `tables`, without going through inserts.
+    '''
+    db = TinyDB(storage=MemoryStorage)
+    db.storage.memory = tables
+    db.clear_cache()
+    return db
+
+
+def write(tables, path):
+    with open(path, 'w') as f:
+        json.dump(tables, f)
+
+
+if __name__ == '__main__':
+    import analytics # Makes sure player.py is imported through analytics first
+    from player import player_names
+
+    if len(sys.argv) not in (3, 4):
+        print(__doc__)
+        sys.exit(1)
+    count, path = int(sys.argv[1]), sys.argv[2]
+    seed = int(sys.argv[3]) if len(sys.argv) == 4 else 0
+    write(generate(count, player_names, seed), path)
+    print(f'Wrote {count} matches to {path}')
@@ -0,0 +1,134 @@
+'''
+A columnar copy of the team game tables, for computing stats over the
+whole history with NumPy instead of looping over documents in Python.
+Every player gets an integer index, a team is a row of indices (-1
+where a team has fewer players than the widest game), and the scores
+and dates are plain arrays.
+'''
+
+import numpy as np
+
+from game import team_games
+
+
+class ColumnarTable:
+    '''
+    The matches of a single team game, one row per match.
+    '''
+
+    def __init__(self, game, team1, team2, score1, score2, timestamp) -> None:
+        self.game = game
+        self.team1 = team1         # (matches, ppt) player indices of the winning team
+        self.team2 = team2         # (matches, ppt) player indices of the losing team
+        self.score1 = score1       # Winning scores
+        self.score2 = score2       # Losing scores
+        self.timestamp = timestamp # Epoch seconds
+
+    @classmethod
+    def from_matches(cls, game, matches, index):
+        '''
+        Builds the columns from TinyDB-style match documents. `index` maps
+        player names to their index and is extended with any new names.
+        '''
+        count = len(matches)
+        team1 = np.full((count, game.ppt), -1, dtype=np.int32)
+        team2 = np.full((count, game.ppt), -1, dtype=np.int32)
+        for row, match in enumerate(matches):
+            for position, name in enumerate(match['team1']):
+                team1[row, position] = index.setdefault(name, len(index))
+            for position, name in enumerate(match['team2']):
+                team2[row, position] = index.setdefault(name, len(index))
+        return cls(
+            game, team1, team2,
+            np.fromiter((match['score1'] for match in matches), dtype=np.float64, count=count),
+            np.fromiter((match['score2'] for match in matches), dtype=np.float64, count=count),
+            np.array([match['date'] for match in matches], dtype='datetime64[s]').astype(np.int64),
+        )
+
+    def __len__(self):
+        return len(self.score1)
+
+
+def count(indices, players, weights=None):
+    '''
+    Sums `weights` (or counts occurrences) per player index, ignoring the
+    -1 padding. `weights` is broadcast against `indices`.
+    '''
+    valid = indices >= 0
+    if weights is not None:
+        weights = np.broadcast_to(weights, indices.shape)[valid]
+    return np.bincount(indices[valid], weights=weights, minlength=players)
+
+
+class ColumnarStore:
+    '''
+    Columnar copies of every team game table, sharing one player index.
+    '''
+
+    def __init__(self, tables, names) -> None:
+        self.tables = tables # Game name -> ColumnarTable
+        self.names = names   # Player index -> name
+
+    @classmethod
+    def from_db(cls, db, index=None):
+        '''
+        Builds the columns of every team game in `db`. Players are numbered
+        in the order they show up unless `index` (name -> index) says
+        otherwise, new names are numbered after the ones in it.
+        '''
+        return cls.from_tables({game.name: db.table(game.name).all() for game in team_games}, index)
+
+    @classmethod
+    def from_tables(cls, tables, index=None):
+        '''
+        Same as from_db(), from the list of matches of each game keyed by name.
+        '''
+        index = {} if index is None else index
+        tables = {
+            game.name: ColumnarTable.from_matches(game, tables.get(game.name, []), index)
+            for game in team_games
+        }
+        return cls(tables, sorted(index, key=index.get))
+
+    def totals(self):
+        '''
+        Computes the per-player counters of Player (wins, losses, matches,
+        perfects, the per-game stats and the per-side records in Doubles)
+        for everyone at once. Returns a dict of arrays indexed by player,
+        with the per-game ones keyed by game name.
+        '''
+        players = len(self.names)
+        result = {
+            'wins': np.zeros(players, dtype=np.int64),
+            'losses': np.zeros(players, dtype=np.int64),
+            'perfects': np.zeros(players, dtype=np.int64),
+            'games': {},
+            'matches_per_side': None,
+        }
+        for name, table in self.tables.items():
+            score1 = table.score1[:, None]
+            score2 = table.score2[:, None]
+            wins = count(table.team1, players).astype(np.int64)
+            losses = count(table.team2, players).astype(np.int64)
+            result['wins'] += wins
+            result['losses'] += losses
+            result['perfects'] += count(table.team1, players, table.score2[:, None] == 0).astype(np.int64)
+            result['games'][name] = {
+                'wins': wins,
+                'losses': losses,
+                'matches': wins + losses,
+                'points': count(table.team1, players, score1) + count(table.team2, players, score2),
+                'point_difference': count(table.team1, players, score1 - score2) + count(table.team2, players, score2 - score1),
+            }
+            if name == 'Doubles':
+                # Side 0 is the left player and side 1 the right one
+                result['matches_per_side'] = [
+                    {
+                        'wins': count(table.team1[:, side], players).astype(np.int64),
+                        'losses': count(table.team2[:, side], players).astype(np.int64),
+                    } for side in range(2)
+                ]
+                for side in result['matches_per_side']:
+                    side['matches'] = side['wins'] + side['losses']
+        result['matches'] = result['wins'] + result['losses']
+        return result
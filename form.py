@@ -2,8 +2,8 @@ from nicegui import ui
 from game import games, team_games, ffa_games, Game, get_game
 from player import player_names
 from time import time
-import analytics
 from datetime import datetime
+from writer import submissions
 
 def get_lambda(y):
     return lambda x: x == y
@@ -22,7 +22,7 @@ class TeamForm:
         Renders a dropdown with all the player names.
         '''
         select = ui.select(
-            player_names,
+            list(player_names),
             label=label,
         ).classes('w-full')
         return select
@@ -91,7 +91,7 @@ class FFAForm:
         with ui.card().classes('w-full'):
             with ui.column().classes('w-full'):
                 self.winner_dropdown = ui.select(
-                    player_names,
+                    list(player_names),
                     label="Winner",
                 ).classes('w-full')
 
@@ -122,9 +122,8 @@ class FFAForm:
 class Form:
     SUBMISSION_RATE_LIMIT = 5 # How often people can submit data
 
-    def __init__(self, page) -> None:
+    def __init__(self) -> None:
         self.last_submission = 0
-        self.page = page
 
     def errors(self):
         game = get_game(self.game_dropdown.value)
@@ -151,9 +150,11 @@ class Form:
 
     def __call__(self):
         game = get_game(self.game_dropdown.value)
+        now = datetime.now().replace(microsecond=0)
         data = {
             'game': game.name,
-            'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'date': now.strftime("%Y-%m-%d %H:%M:%S"),
+            'timestamp': now.timestamp(),
             'ffa': game.ffa
         }
         if game.ffa:
@@ -183,13 +184,10 @@ class Form:
                 color='orange'
             )
             return
-        table = analytics.db.table(self.game_dropdown.value)
-        state = self()
-        table.insert(state)
+        # Written to the database, and the stats and charts updated, by writer.py
+        submissions.put(self())
         self.last_submission = time()
         ui.notify('Submitted.')
-        print(f'Submit {state}')
-        self.page.refresh_charts()
 
     def on_game_changed(self):
         pass
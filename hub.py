@@ -0,0 +1,72 @@
+'''
+Keeps track of the dashboard (charts, player panels and match logs) of
+every connected client, so that a submission updates all of them and
+not just whoever loaded the page last.
+'''
+
+from nicegui import Client
+
+import analytics
+import metrics
+
+
+class Dashboard:
+    '''
+    The elements rendered for a single client that need refreshing when
+    a match is submitted.
+    '''
+
+    def __init__(self, client, charts, players, logs) -> None:
+        self.client = client
+        self.charts = charts   # List of (ui.highchart, update function) tuples
+        self.players = players # analytics.PlayerPanels
+        self.logs = logs       # Game name -> Logs grid
+
+    @property
+    def connected(self):
+        return self.client.id in Client.instances
+
+
+class Hub:
+    '''
+    Fans a change out to every dashboard. The chart series are cached on
+    the stats snapshot (see analytics.per_snapshot), so they are computed
+    once per change and the same payload is sent to every client.
+    '''
+
+    def __init__(self) -> None:
+        self.dashboards = []
+
+    def subscribe(self, dashboard):
+        self.prune()
+        self.dashboards.append(dashboard)
+
+    def prune(self):
+        '''
+        Forgets about the dashboards of clients that are gone, and the
+        stat card subscriptions of their player panels.
+        '''
+        for dashboard in self.dashboards:
+            if not dashboard.connected:
+                dashboard.players.release()
+        self.dashboards = [dashboard for dashboard in self.dashboards if dashboard.connected]
+
+    @metrics.instrumented('refresh_charts')
+    def refresh_charts(self, games=()):
+        '''
+        Refreshes the data in all the charts and tables of every client.
+        The player stats themselves are already up-to-date at this point,
+        see analytics.apply_match(), and the stat cards update themselves.
+        Of the Logs grids, only the ones showing one of `games` are asked
+        to re-fetch their rows.
+        '''
+        self.prune()
+        for dashboard in self.dashboards:
+            for chart, update_func in dashboard.charts + dashboard.players.charts:
+                analytics.update_chart(chart, update_func)
+            for game in games:
+                if game in dashboard.logs:
+                    analytics.refresh_log(dashboard.logs[game])
+
+
+hub = Hub()
@@ -0,0 +1,299 @@
+'''
+An in-memory index over the match history of each game, used to answer
+the paged requests of the Logs grids without handing every match to
+every client. Rows are kept in order of their numeric timestamp with a
+per-player index on top, so date ranges are cut out with a binary search
+and player filters only look at that player's matches. The same index
+is used to pick out the matches of a time range for the stats.
+
+The whole history stays in memory, so the rows are kept as MatchRecords
+rather than as the dicts they come in as, and only turned back into dicts
+for the rows that are sent out.
+'''
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from heapq import merge
+
+from game import games
+
+# Columns holding player names
+player_fields = ['team1', 'team2', 'winner']
+# Text filters that can be answered by looking up the matching players
+positive_text_types = ('contains', 'equals', 'startsWith', 'endsWith')
+
+
+def timestamp(date):
+    '''
+    Turns a "%Y-%m-%d %H:%M:%S" (or just "%Y-%m-%d") string into epoch seconds.
+    '''
+    return datetime.fromisoformat(date).timestamp()
+
+
+def row_key(record):
+    return (record.timestamp, record.id)
+
+
+def compact(number):
+    '''
+    Scores are stored as floats like 11.0, which take up more room than
+    the small ints they are.
+    '''
+    return int(number) if number is not None and float(number).is_integer() else number
+
+
+def field_value(value):
+    if isinstance(value, list):
+        return ','.join(value)
+    return value if value is not None else ''
+
+
+games_by_index = {game.index: game for game in games}
+game_indices = {game.name: game.index for game in games}
+
+
+class MatchRecord:
+    '''
+    A single match of the history, as small as it gets in plain Python:
+    the game is its Game.index, players are their ids on the roster (see
+    MatchIndex), scores are ints and the date is only kept as a timestamp.
+    '''
+    __slots__ = ('id', 'game', 'timestamp', 'team1', 'team2', 'score1', 'score2', 'winner', 'lives')
+
+    def __init__(self, id, game, timestamp, team1=None, team2=None, score1=None, score2=None, winner=None, lives=None):
+        self.id = id
+        self.game = game
+        self.timestamp = timestamp
+        self.team1 = team1
+        self.team2 = team2
+        self.score1 = score1
+        self.score2 = score2
+        self.winner = winner
+        self.lives = lives
+
+    @property
+    def date(self):
+        return datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MatchIndex:
+    '''
+    The rows of a single game, sorted by date, plus the rows of each
+    player in each of the player columns. Players are stored as their id
+    on `roster` (see roster.py) when they have one, so the rows show
+    everyone under their current name.
+    '''
+
+    def __init__(self, rows, roster=None):
+        self.roster = roster
+        self.teams = {} # Every team is stored once and shared by its matches
+        self.build([self.record(row) for row in rows])
+
+    def build(self, records):
+        self.rows = sorted(records, key=row_key)
+        self.by_player = {}
+        for row in self.rows:
+            self.index_players(row)
+        self.sorted_by = {} # Cached sort orders of the whole table, keyed by (field, descending)
+
+    def player_id(self, name):
+        return self.roster.ids.get(name, name) if self.roster else name
+
+    def player_name(self, player):
+        return self.roster.name_of(player) if isinstance(player, int) else player
+
+    def team(self, names):
+        if names is None:
+            return None
+        team = tuple(self.player_id(name) for name in names)
+        return self.teams.setdefault(team, team)
+
+    def record(self, row):
+        '''
+        Turns a row (a match document with its `id` and `timestamp`) into a MatchRecord.
+        '''
+        return MatchRecord(
+            row['id'], game_indices[row['game']], compact(row['timestamp']),
+            self.team(row.get('team1')), self.team(row.get('team2')), compact(row.get('score1')), compact(row.get('score2')),
+            self.player_id(row['winner']) if row.get('winner') is not None else None, compact(row.get('lives')),
+        )
+
+    def row(self, record):
+        '''
+        Turns a MatchRecord back into a row, like the ones it was made from.
+        '''
+        game = games_by_index[record.game]
+        row = {'game': game.name, 'date': record.date, 'timestamp': record.timestamp, 'ffa': game.ffa, 'id': record.id}
+        if game.ffa:
+            row.update(winner=self.value(record, 'winner'), lives=record.lives)
+        else:
+            row.update(team1=self.value(record, 'team1'), score1=record.score1, team2=self.value(record, 'team2'), score2=record.score2)
+        return row
+
+    def value(self, record, field):
+        '''
+        What `row(record)[field]` would be, without building the row.
+        '''
+        if field in ('team1', 'team2'):
+            team = getattr(record, field)
+            return None if team is None else [self.player_name(player) for player in team]
+        if field == 'winner':
+            return None if record.winner is None else self.player_name(record.winner)
+        if field in ('game', 'ffa'):
+            return getattr(games_by_index[record.game], 'name' if field == 'game' else 'ffa')
+        return getattr(record, field, None)
+
+    def index_players(self, record):
+        for field in player_fields:
+            value = getattr(record, field)
+            for player in (value if isinstance(value, tuple) else [] if value is None else [value]):
+                insort(self.by_player.setdefault((field, player), []), record, key=row_key)
+
+    def add(self, row):
+        record = self.record(row)
+        self.rows.insert(bisect_right(self.rows, row_key(record), key=row_key), record)
+        self.index_players(record)
+        self.sorted_by.clear()
+
+    def remove(self, doc_id):
+        self.build([record for record in self.rows if record.id != doc_id])
+
+    def update(self, row):
+        record = self.record(row)
+        self.build([record if old.id == record.id else old for old in self.rows])
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def date_range(rows, start, end):
+        '''
+        Cuts the rows from `start` up to (not including) `end` out of a list
+        of rows that is sorted by date. The bounds are epoch seconds, and
+        either of them can be None.
+        '''
+        low = bisect_left(rows, (start,), key=row_key) if start is not None else 0
+        high = bisect_left(rows, (end,), key=row_key) if end is not None else len(rows)
+        return rows[low:high]
+
+    def between(self, start=None, end=None):
+        '''
+        The rows played from `start` up to (not including) `end`, in order.
+        '''
+        return [self.row(record) for record in self.date_range(self.rows, start, end)]
+
+    def query(self, start=0, end=100, sort_model=None, filter_model=None):
+        '''
+        Answers a request of the AG Grid infinite row model. Returns the
+        rows from `start` to `end` after filtering and sorting, along with
+        the total number of rows that matched the filter.
+        '''
+        filter_model = dict(filter_model or {})
+        rows = self.rows
+
+        # Player filters go through the per-player index first
+        for field in player_fields:
+            if filter_model.get(field, {}).get('type') not in positive_text_types:
+                continue
+            players = [player for (f, player) in self.by_player if f == field]
+            players = [player for player in players if matches_filter(self.player_name(player), filter_model[field])]
+            matched = merge(*[self.by_player[(field, player)] for player in players], key=row_key)
+            matched = list({record.id: record for record in matched}.values()) # A team can match more than once
+            if rows is not self.rows:
+                ids = {record.id for record in rows}
+                matched = [record for record in matched if record.id in ids]
+            rows = matched
+            del filter_model[field]
+
+        # Simple date ranges are resolved with a binary search
+        date_filter = filter_model.get('date')
+        if date_filter and date_filter.get('type') in date_types:
+            rows = self.date_range(rows, *date_bounds(date_filter))
+            del filter_model['date']
+
+        # Anything else is checked row by row on what is left
+        for field, model in filter_model.items():
+            rows = [record for record in rows if matches_filter(self.value(record, field), model)]
+
+        if sort_model:
+            order = sort_model[0]
+            field, descending = order['colId'], order['sort'] == 'desc'
+            if rows is self.rows:
+                if (field, descending) not in self.sorted_by:
+                    self.sorted_by[(field, descending)] = self.sort(rows, field, descending)
+                rows = self.sorted_by[(field, descending)]
+            else:
+                rows = self.sort(rows, field, descending)
+
+        return [self.row(record) for record in rows[start:end]], len(rows)
+
+    def sort(self, rows, field, descending):
+        if field == 'date':
+            return rows[::-1] if descending else rows
+        return sorted(rows, key=lambda record: field_value(self.value(record, field)), reverse=descending)
+
+
+date_types = ('equals', 'greaterThan', 'lessThan', 'inRange')
+
+def date_bounds(model):
+    '''
+    Turns a date filter into [start, end) bounds in epoch seconds for
+    MatchIndex.date_range(). Filters work on whole days, and ranges
+    include both ends.
+    '''
+    day = lambda key: datetime.fromisoformat((model.get(key) or '1970-01-01')[:10])
+    start_of = lambda key: day(key).timestamp()
+    end_of = lambda key: (day(key) + timedelta(days=1)).timestamp()
+    return {
+        'equals': lambda: (start_of('dateFrom'), end_of('dateFrom')),
+        'greaterThan': lambda: (end_of('dateFrom'), None),
+        'lessThan': lambda: (None, start_of('dateFrom')),
+        'inRange': lambda: (start_of('dateFrom'), end_of('dateTo')),
+    }[model['type']]()
+
+
+def matches_filter(value, model):
+    '''
+    Checks a single value against an AG Grid filter model, including the
+    combined form with an `operator` and a list of `conditions`.
+    '''
+    if 'conditions' in model:
+        results = [matches_filter(value, condition) for condition in model['conditions']]
+        return all(results) if model.get('operator') == 'AND' else any(results)
+
+    kind = model.get('type')
+    if isinstance(value, list): # A team matches if any of its players does
+        results = [matches_filter(v, model) for v in value]
+        return all(results) if kind in ('notContains', 'notEqual') else any(results)
+    if model.get('filterType') == 'number':
+        target = model.get('filter')
+        if value is None or value == '':
+            return kind == 'blank'
+        return {
+            'equals': lambda: value == target,
+            'notEqual': lambda: value != target,
+            'lessThan': lambda: value < target,
+            'lessThanOrEqual': lambda: value <= target,
+            'greaterThan': lambda: value > target,
+            'greaterThanOrEqual': lambda: value >= target,
+            'inRange': lambda: target <= value <= model.get('filterTo'),
+        }.get(kind, lambda: True)()
+    if model.get('filterType') == 'date':
+        if kind not in date_types:
+            return True
+        if not value:
+            return False
+        start, end = date_bounds(model)
+        value = timestamp(value)
+        return (start is None or value >= start) and (end is None or value < end)
+
+    text = str(value if value is not None else '').lower()
+    target = str(model.get('filter') or '').lower()
+    return {
+        'contains': lambda: target in text,
+        'notContains': lambda: target not in text,
+        'equals': lambda: text == target,
+        'notEqual': lambda: text != target,
+        'startsWith': lambda: text.startswith(target),
+        'endsWith': lambda: text.endswith(target),
+    }.get(kind, lambda: True)()
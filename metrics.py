@@ -0,0 +1,162 @@
+'''
+Lightweight timing of the hot paths (submissions, stats rebuilds, chart
+refreshes, page builds) and a few counters, served by the /metrics
+endpoint in server.py in the Prometheus text format (or as JSON). Timing
+a stage costs a couple of perf_counter() calls and a bisect, so it's
+always on.
+'''
+
+import asyncio
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+LOOP_INTERVAL = 0.1 # How often watch_loop() checks on the event loop, in seconds
+
+
+class Histogram:
+    '''
+    How long a stage took, counted into fixed buckets.
+    '''
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1) # The last one is everything above the last bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        '''
+        (upper bound, observations up to it) pairs, the way Prometheus wants them.
+        '''
+        total = 0
+        for bound, count in zip(BUCKETS + [float('inf')], self.counts):
+            total += count
+            yield bound, total
+
+
+class Timer:
+    def __init__(self, histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+stages = {}   # Stage name -> Histogram
+counters = {} # Counter name -> count
+gauges = {}   # Gauge name -> (label name, function), read when scraped
+
+
+def histogram(stage):
+    if stage not in stages:
+        stages[stage] = Histogram()
+    return stages[stage]
+
+
+def timed(stage):
+    '''
+    Times a stage, as a context manager: `with metrics.timed('db_write'): ...`
+    '''
+    return Timer(histogram(stage))
+
+
+def observe(stage, seconds):
+    '''
+    Records how long a stage took, for stages that don't fit in a `with`.
+    '''
+    histogram(stage).observe(seconds)
+
+
+def instrumented(stage):
+    '''
+    Decorator timing every call of a function as `stage`.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(counter, amount=1):
+    counters[counter] = counters.get(counter, 0) + amount
+
+
+def gauge(name, label=None):
+    '''
+    Registers a function as a gauge. It returns a single value, or a dict
+    of {value of `label`: value} if a label is given.
+    '''
+    def decorator(func):
+        gauges[name] = (label, func)
+        return func
+    return decorator
+
+
+def read_gauges():
+    values = {}
+    for name, (label, func) in gauges.items():
+        values[name] = (label, func() if label else {None: func()})
+    return values
+
+
+async def watch_loop():
+    '''
+    Measures how late the event loop wakes up from a sleep, as the
+    `loop_lag` stage. Anything that blocks the loop (a big rebuild, a slow
+    write) holds up every client, and shows up here.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_INTERVAL)
+        observe('loop_lag', max(loop.time() - start - LOOP_INTERVAL, 0))
+
+
+def as_json():
+    return {
+        'stages': {
+            stage: {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+            } for stage, histogram in stages.items()
+        },
+        'counters': dict(counters),
+        'gauges': {
+            name: values[None] if label is None else values
+            for name, (label, values) in read_gauges().items()
+        },
+    }
+
+
+def as_prometheus(prefix='topspin'):
+    lines = [f'# TYPE {prefix}_stage_seconds histogram']
+    for stage, histogram in stages.items():
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    for counter, value in counters.items():
+        lines.append(f'# TYPE {prefix}_{counter}_total counter')
+        lines.append(f'{prefix}_{counter}_total {value}')
+    for name, (label, values) in read_gauges().items():
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        for label_value, value in values.items():
+            labels = '' if label is None else f'{{{label}="{label_value}"}}'
+            lines.append(f'{prefix}_{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,44 @@
+'''
+One-shot migration of the TinyDB JSON databases into SQLite. Every
+`data/foo.json` is copied into `data/foo.sqlite`, keeping the document
+ids. Other JSON files in there (the seasons file, the roster, the
+`.stats.json` totals of past seasons) are left alone. Pass file names to
+migrate only those.
+
+    python migrate_sqlite.py [data/database.json ...]
+'''
+
+import glob
+import json
+import os
+import sys
+
+from tinydb.table import Document
+
+from game import get_game
+from storage import SQLiteDB
+
+paths = sys.argv[1:] or sorted(path for path in glob.glob('data/*.json') if not path.endswith('.stats.json'))
+
+for path in paths:
+    target = os.path.splitext(path)[0] + '.sqlite'
+    if os.path.exists(target):
+        print(f'Skipping {path}, {target} already exists')
+        continue
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+    # A database is nothing but tables named after games
+    if not isinstance(data, dict) or not all(get_game(name) for name in data):
+        print(f'Skipping {path}, not a match database')
+        continue
+
+    db = SQLiteDB(target)
+    count = 0
+    for gamemode, matches in data.items():
+        table = db.table(gamemode)
+        for doc_id, match in matches.items():
+            table.insert(Document(match, int(doc_id)))
+            count += 1
+    db.close()
+    print(f'Migrated {count} matches from {path} to {target}')
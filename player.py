@@ -1,10 +1,16 @@
+from collections.abc import Mapping
 from game import games
 import analytics
-from tinydb import Query
+import metrics
+import numpy as np
+import storage
+from rating import Ratings
+from roster import Roster
+from seasons import past_seasons
 from utils import ratio_safe
 
-# The list of players.
-player_names = [
+# The roster until there is a `players_file`, see roster.py
+default_names = [
     'Adams',
     'Alonzo',
     'Boris',
@@ -21,7 +27,7 @@ player_names = [
     'Yan',
     'Zack'
 ]
-player_names.sort()
+default_names.sort()
 
 
 class Team():
@@ -37,19 +43,120 @@ class Team():
         return f'[{",".join(self.players)}]-{self.score}'
 
 
-def sorted_by_value(d):
-    return {k: v for k, v in sorted(d.items(), key=lambda item: item[1])}
+class PairCounts():
+    '''
+    How many games every pair of players played together and against each
+    other, and how many of those they won and lost, as one P×P matrix per
+    stat. Row i is from the point of view of the player with index i, so
+    `games_with[i, j]` is the number of games player i played with player j.
+    '''
+    fields = ['games_with', 'wins_with', 'losses_with', 'games_against', 'wins_against', 'losses_against']
+
+    def __init__(self, size) -> None:
+        self.resize(size)
+
+    def resize(self, size):
+        '''
+        Throws away every count and makes room for `size` players.
+        '''
+        for field in PairCounts.fields:
+            setattr(self, field, np.zeros((size, size), dtype=np.int32))
+
+    def grow(self, size):
+        '''
+        Makes room for `size` players, keeping the counts of the ones
+        that are already there.
+        '''
+        for field in PairCounts.fields:
+            counts = getattr(self, field)
+            kept = min(size, len(counts))
+            grown = np.zeros((size, size), dtype=np.int32)
+            grown[:kept, :kept] = counts[:kept, :kept]
+            setattr(self, field, grown)
+
+    def reset_row(self, index):
+        for field in PairCounts.fields:
+            getattr(self, field)[index] = 0
+
+    def copy(self):
+        counts = PairCounts(0)
+        for field in PairCounts.fields:
+            setattr(counts, field, getattr(self, field).copy())
+        return counts
+
+
+class PairRow(Mapping):
+    '''
+    A read-only view of one player's row of a pair count matrix, looked up
+    by the name of the other player like the dicts it replaced. `owner` is
+    the id of the player the row belongs to.
+    '''
+
+    def __init__(self, row, owner) -> None:
+        self.row = row
+        self.owner = owner
+
+    def __getitem__(self, name):
+        return int(self.row[roster.ids[name]])
+
+    def __iter__(self):
+        return (name for id, name in enumerate(roster.names) if id != self.owner)
+
+    def __len__(self):
+        return len(roster) - 1
+
+
+def pair_row(field):
+    '''
+    A property giving the player's row of one of the matrices in `pairs`.
+    '''
+    return property(lambda self: PairRow(getattr(pairs, field)[self.index], self.index))
+
+
+def rates(wins, games):
+    return np.divide(wins, games, out=np.zeros(len(games)), where=games > 0)
+
+
+def pick(values, mask, highest):
+    '''
+    Returns the id of the player with the lowest or highest of `values`
+    among the ones where `mask` is set, or None if there are none. Ties go
+    to the first player for the lowest and the last one for the highest.
+    '''
+    if not mask.any():
+        return None
+    if highest:
+        masked = np.where(mask, values, -np.inf)[::-1]
+        return len(values) - 1 - int(np.argmax(masked))
+    return int(np.argmin(np.where(mask, values, np.inf)))
 
 
 class Player():
     '''
-    Class that defines the attributes associated with a player so that
-    we can just bind the stat card fields to the attributes here so that
-    they update automatically.
+    Class that defines the attributes associated with a player. The stat
+    cards subscribe to the ones in `card_stats` (see subscribe()), and
+    publish() pushes them the values that changed after every update.
     '''
 
-    def __init__(self, name) -> None:
-        self.name = name
+    # The stats shown on the stat cards, see publish()
+    card_stats = [
+        'wins', 'losses', 'matches', 'win_rate', 'points_per_game', 'difference_per_game',
+        'best_position', 'best_mate_str', 'worst_mate_str', 'nemesis_str', 'antinemesis_str', 'perfects', 'rating', 'career',
+    ]
+
+    name = property(lambda self: roster.name_of(self.index))
+
+    games_with = pair_row('games_with')
+    wins_with = pair_row('wins_with')
+    losses_with = pair_row('losses_with')
+    games_against = pair_row('games_against')
+    wins_against = pair_row('wins_against')
+    losses_against = pair_row('losses_against')
+
+    def __init__(self, index) -> None:
+        self.index = index # Id in the roster, and row/column in `pairs`
+        self.subscribers = {stat: [] for stat in Player.card_stats}
+        self.published = {}
         self.reset()
 
     def reset(self):
@@ -60,16 +167,14 @@ class Player():
         self.server_wins = 0
         self.receiver_wins = 0
         self.matches_per_side = [{'wins': 0, 'losses': 0, 'matches': 0}, {'wins': 0, 'losses': 0, 'matches': 0}]
-        self.games_with = {p: 0 for p in player_names if p != self.name}
-        self.wins_with = {p: 0 for p in player_names if p != self.name}
-        self.losses_with = {p: 0 for p in player_names if p != self.name}
-        self.games_against = {p: 0 for p in player_names if p != self.name}
-        self.wins_against = {p: 0 for p in player_names if p != self.name}
-        self.losses_against = {p: 0 for p in player_names if p != self.name}
-        self.teammate_ranking = {p: 0 for p in player_names if p != self.name}
-        self.opponent_ranking = {p: 0 for p in player_names if p != self.name}
+        pairs.reset_row(self.index)
 
         self.games = {game.name: {'wins': 0, 'losses': 0, 'matches': 0, 'points': 0, 'point_difference': 0} for game in games}
+        self.best_mate = None # Ids in the roster, the names are looked up in derive()
+        self.worst_mate = None
+        self.nemesis = None
+        self.antinemesis = None
+        self.derive()
 
     def avg_points_ing(self, game):
         return ratio_safe(self.games[game]['points'], self.games[game]['matches'])
@@ -77,159 +182,221 @@ class Player():
     def avg_point_difference_in(self, game):
         return ratio_safe(self.games[game]['point_difference'], self.games[game]['matches'])
 
-    def __getattribute__(self, name: str):
-        '''
-        Because the bind_text_from() method only accepts attributes
-        (not functions) I am overriding the getattr method to provide
-        some of the more complex stats that are either computed from
-        other fields or have text.
-        '''
-        if name == 'win_rate':
-            if self.matches == 0:
-                return 0
-            return f'{int(self.wins/self.matches * 100)}%'
-
-        if name == 'best_position':
-            r = self.matches_per_side[1]
-            l = self.matches_per_side[0]
-
-            if self.games['Doubles']['matches'] == 0:
-                return None
-
-            r_win_rate = int(ratio_safe(r['wins'], r['matches']) * 100)
-            l_win_rate = int(ratio_safe(l['wins'], l['matches']) * 100)
-            best_position = 'Right ({left}% : {right}%)' if r_win_rate > l_win_rate else "Left ({left}% : {right}%)"
-            best_position = 'Either' if r_win_rate == l_win_rate else best_position
-            return best_position.format(left=l_win_rate, right=r_win_rate)
-
-        if name == 'points_per_game':
-            singles = self.avg_points_ing('Singles')
-            doubles = self.avg_points_ing('Doubles')
-            triples = self.avg_points_ing('Triples')
-            return f'{singles:.2f}/{doubles:.2f}/{triples:.2f}'
-
-        if name == 'difference_per_game':
-            singles = self.avg_point_difference_in('Singles')
-            doubles = self.avg_point_difference_in('Doubles')
-            triples = self.avg_point_difference_in('Triples')
-            return f'{singles:.2f}/{doubles:.2f}/{triples:.2f}'
-
-        if name == 'best_mate_str':
-            if  not self.best_mate or self.games['Doubles']['matches'] + self.games['Triples']['matches'] == 0:
-                return None
-            percent = int(ratio_safe(self.wins_with[self.best_mate], self.games_with[self.best_mate], percent=True))
-            return f'{self.best_mate} | {percent}% | ({self.wins_with[self.best_mate]} : {self.losses_with[self.best_mate]})'
-
-        if name == 'worst_mate_str':
-            if not self.worst_mate or self.games['Doubles']['matches'] + self.games['Triples']['matches'] == 0:
-                return None
-            percent = int(ratio_safe(self.wins_with[self.worst_mate], self.games_with[self.worst_mate], percent=True))
-            return f'{self.worst_mate} | {percent}% | ({self.wins_with[self.worst_mate]} : {self.losses_with[self.worst_mate]})'
-
-        if name == 'nemesis_str':
-            if not self.nemesis or self.games['Doubles']['matches'] + self.games['Triples']['matches'] == 0:
-                return None
-            percent = int(ratio_safe(self.wins_against[self.nemesis], self.games_against[self.nemesis], percent=True))
-            return f'{self.nemesis} | {percent}% | ({self.wins_against[self.nemesis]} : {self.losses_against[self.nemesis]})'
-
-        if name == 'antinemesis_str':
-            if not self.antinemesis or self.games['Doubles']['matches'] + self.games['Triples']['matches'] == 0:
-                return None
-            percent = int(ratio_safe(self.wins_against[self.antinemesis], self.games_against[self.antinemesis], percent=True))
-            return f'{self.antinemesis} | {percent}% | ({self.wins_against[self.antinemesis]} : {self.losses_against[self.antinemesis]})'
-
-        return super(Player, self).__getattribute__(name)
+    def derive(self):
+        '''
+        Computes the stats that are either computed from other fields or
+        have text. These are worked out once per stats update and stored as
+        plain attributes, so that publish() only has to compare them with
+        what the stat cards were last sent.
+        '''
+        self.win_rate = f'{int(self.wins/self.matches * 100)}%' if self.matches else 0
+        self.best_position = self.get_best_position()
+        self.points_per_game = '/'.join(f'{self.avg_points_ing(game):.2f}' for game in ('Singles', 'Doubles', 'Triples'))
+        self.difference_per_game = '/'.join(f'{self.avg_point_difference_in(game):.2f}' for game in ('Singles', 'Doubles', 'Triples'))
+        self.ratings = ratings.of(self.name)
+        self.rating = '/'.join(str(self.ratings[game]) for game in ('Singles', 'Doubles', 'Triples'))
+
+        # Past seasons only ever come from their precomputed totals
+        career = past_seasons.career(*roster.aliases_of(self.index))
+        wins, losses = career['wins'] + self.wins, career['losses'] + self.losses
+        self.career = f'{wins} : {losses} ({int(ratio_safe(wins, wins + losses, percent=True))}%)'
+
+        played_team_games = self.games['Doubles']['matches'] + self.games['Triples']['matches'] > 0
+        self.best_mate_str = self.record_with(self.best_mate) if played_team_games else None
+        self.worst_mate_str = self.record_with(self.worst_mate) if played_team_games else None
+        self.nemesis_str = self.record_against(self.nemesis) if played_team_games else None
+        self.antinemesis_str = self.record_against(self.antinemesis) if played_team_games else None
+
+    def get_best_position(self):
+        r = self.matches_per_side[1]
+        l = self.matches_per_side[0]
+
+        if self.games['Doubles']['matches'] == 0:
+            return None
+
+        r_win_rate = int(ratio_safe(r['wins'], r['matches']) * 100)
+        l_win_rate = int(ratio_safe(l['wins'], l['matches']) * 100)
+        best_position = 'Right ({left}% : {right}%)' if r_win_rate > l_win_rate else "Left ({left}% : {right}%)"
+        best_position = 'Either' if r_win_rate == l_win_rate else best_position
+        return best_position.format(left=l_win_rate, right=r_win_rate)
+
+    def record_with(self, teammate):
+        if teammate is None:
+            return None
+        i = self.index
+        wins, losses = int(pairs.wins_with[i, teammate]), int(pairs.losses_with[i, teammate])
+        percent = int(ratio_safe(wins, int(pairs.games_with[i, teammate]), percent=True))
+        return f'{roster.name_of(teammate)} | {percent}% | ({wins} : {losses})'
+
+    def record_against(self, opponent):
+        if opponent is None:
+            return None
+        i = self.index
+        wins, losses = int(pairs.wins_against[i, opponent]), int(pairs.losses_against[i, opponent])
+        percent = int(ratio_safe(wins, int(pairs.games_against[i, opponent]), percent=True))
+        return f'{roster.name_of(opponent)} | {percent}% | ({wins} : {losses})'
+
+    def subscribe(self, stat, owner, callback):
+        '''
+        Calls `callback` with the new value of `stat` whenever publish()
+        finds it changed. The subscription is dropped once `owner` (the
+        element showing the value) has been deleted, see prune().
+        '''
+        self.prune()
+        self.subscribers[stat].append((owner, callback))
 
+    def prune(self):
+        '''
+        Drops the subscriptions of every stat whose element has been
+        deleted, along with the client they hold on to. Stats that never
+        change (e.g. of inactive players) would keep them around forever
+        if this only happened when a value is pushed.
+        '''
+        for stat, subscribers in self.subscribers.items():
+            self.subscribers[stat] = [s for s in subscribers if not s[0].is_deleted]
+
+    def publish(self):
+        '''
+        Pushes the card stats that changed since the last call to their
+        subscribers. This is called once the stats are done updating, so
+        nothing has to keep polling the player for changes.
+        '''
+        self.prune()
+        current = {stat: getattr(self, stat) for stat in Player.card_stats}
+        for stat, value in current.items():
+            if stat in self.published and self.published[stat] == value:
+                continue
+            for _, callback in self.subscribers[stat]:
+                callback(value)
+        self.published = current
+
+    def apply(self, match):
+        '''
+        Folds a single match into this player's counters. This is what
+        lets us add a freshly submitted match without re-scanning the
+        whole database. The logic here relies heavily on the fact that
+        Team 1 is always the winning team and Team 2 is always the losing team.
+        Call rank() afterwards to bring the rankings up to date.
+        '''
+        i = self.index
+        # Matches have the names the players had back then, the ids don't change.
+        # Players that aren't on the roster (e.g. in an old database) are None
+        # and left out of the pair counts, but keep their place in the team.
+        team1 = [roster.ids.get(name) for name in match['team1']]
+        team2 = [roster.ids.get(name) for name in match['team2']]
+        if i not in team1 and i not in team2:
+            return # Not one of their matches
+        self.matches += 1
+        mates1 = [j for j in team1 if j is not None]
+        mates2 = [j for j in team2 if j is not None]
+
+        # Player Won
+        if i in team1:
+            team = 'team1'
+            self.wins += 1
+
+            # Did they get a free lunch?
+            if match['score2'] == 0:
+                self.perfects += 1
+
+            # Mark who they won with/against
+            for j in mates1:
+                if j != i:
+                    pairs.wins_with[i, j] += 1
+                    pairs.games_with[i, j] += 1
+            for j in mates2:
+                pairs.wins_against[i, j] += 1
+                pairs.games_against[i, j] += 1
+
+        # Player lost
+        if i in team2:
+            team = 'team2'
+            self.losses += 1
+
+            # Mark who they lost with/against
+            for j in mates2:
+                if j != i:
+                    pairs.losses_with[i, j] += 1
+                    pairs.games_with[i, j] += 1
+            for j in mates1:
+                pairs.losses_against[i, j] += 1
+                pairs.games_against[i, j] += 1
+
+        # Preparing some strings
+        category =  'wins'   if team == 'team1' else 'losses'
+        score =     'score1' if team == 'team1' else 'score2'
+        opp_score = 'score2' if team == 'team1' else 'score1'
+
+        # Update per-game stats
+        stats = self.games[match['game']]
+        stats[category] += 1
+        stats['matches'] += 1
+        stats['points'] += match[score]
+        stats['point_difference'] += match[score] - match[opp_score]
+
+        # Which position did they lose in?
+        if match['game'] == 'Doubles':
+            side = int((team1 if team == 'team1' else team2)[1] == i)
+            self.matches_per_side[side]['matches'] += 1
+            self.matches_per_side[side][category] += 1
+
+    def rank(self):
+        '''
+        Finds the best/worst teammate and the nemesis/anti-nemesis from the
+        player's rows of the pair counts, and re-computes the derived stats
+        along with them. Only players with at least 10 games together/against
+        are ranked.
+        '''
+        i = self.index
+        mates = pairs.games_with[i] >= 10
+        opponents = (pairs.games_against[i] >= 10) & (pairs.games_with[i] > 0)
+        with_rates = rates(pairs.wins_with[i], pairs.games_with[i])
+        against_rates = rates(pairs.wins_against[i], pairs.games_against[i])
+
+        self.best_mate = pick(with_rates, mates, highest=True)
+        self.worst_mate = pick(with_rates, mates, highest=False)
+        self.nemesis = pick(against_rates, opponents, highest=False)
+        self.antinemesis = pick(against_rates, opponents, highest=True)
+        self.derive()
+
+    @metrics.instrumented('player_refresh')
     def refresh(self):
         '''
-        Re-scans the database and updates the player stats accordingly.
-        The logic here relies heavily on the fact that Team 1 is always
-        the winning team and Team 2 is always the losing team.
+        Re-scans the database and rebuilds the player stats from scratch.
         '''
         self.reset()
         for game in games:
-            table = analytics.db.table(game.name)
-            match = Query()
-            all_matches = table.search(match.team1.any(
-                self.name) | (match.team2.any(self.name)))
-            self.matches += len(all_matches)
-            for match in all_matches:
-                # Player Won
-                if self.name in match['team1']:
-                    team = 'team1'
-                    self.wins += 1
-
-                    # Did they get a free lunch?
-                    if match['score2'] == 0:
-                        self.perfects += 1
-
-                    # Mark who they won with/against
-                    for teammate in match['team1']:
-                        if teammate != self.name:
-                            self.wins_with[teammate] += 1
-                            self.games_with[teammate] += 1
-                    for opponent in match['team2']:
-                        self.wins_against[opponent] += 1
-                        self.games_against[opponent] += 1
-
-                # Player lost
-                if self.name in match['team2']:
-                    team = 'team2'
-                    self.losses += 1
-
-                    # Mark who they lost with/against
-                    for teammate in match['team2']:
-                        if teammate != self.name:
-                            self.losses_with[teammate] += 1
-                            self.games_with[teammate] += 1
-                    for opponent in match['team1']:
-                        self.losses_against[opponent] += 1
-                        self.games_against[opponent] += 1
-
-                # Preparing some strings
-                category =  'wins'   if team == 'team1' else 'losses'
-                score =     'score1' if team == 'team1' else 'score2'
-                opp_score = 'score2' if team == 'team1' else 'score1'
-
-                # Update per-game stats
-                self.games[game.name][category] += 1
-                self.games[game.name]['points'] += match[score]
-                self.games[game.name]['point_difference'] += match[score] - match[opp_score]
-
-                # Which position did they lose in?
-                if match['game'] == 'Doubles':
-                    self.matches_per_side[int(match[team][1] == self.name)]['matches'] += 1
-                    self.matches_per_side[int(match[team][1] == self.name)][category] += 1
-
-            self.games[game.name]['matches'] = \
-                self.games[game.name]['wins'] + self.games[game.name]['losses']
-
-        for player in players:
-            if player == self: continue
-            if self.games_with[player.name] < 10:
-                del self.teammate_ranking[player.name]
-            else:
-                self.teammate_ranking[player.name] = ratio_safe(self.wins_with[player.name], self.games_with[player.name])
-            if self.games_against[player.name] < 10:
-                del self.opponent_ranking[player.name]
-            else:
-                self.opponent_ranking[player.name] = ratio_safe(self.wins_against[player.name], self.games_against[player.name])
-
-        self.wins_with = sorted_by_value(self.wins_with)
-        self.wins_against = sorted_by_value(self.wins_against)
-        self.losses_with = sorted_by_value(self.losses_with)
-        self.losses_against = sorted_by_value(self.losses_against)
-        self.teammate_ranking = sorted_by_value(self.teammate_ranking)
-        self.opponent_ranking = sorted_by_value(self.opponent_ranking)
-
-        ranked_played_with = [p for p in self.teammate_ranking.keys() if self.games_with[p] > 0]
-        ranked_played_against = [p for p in self.opponent_ranking.keys() if self.games_with[p] > 0]
-        self.best_mate = ranked_played_with[-1] if len(ranked_played_with) > 0 else None
-        self.worst_mate = ranked_played_with[0] if len(ranked_played_with) > 0 else None
-        self.nemesis = ranked_played_against[0] if len(ranked_played_against) > 0 else None
-        self.antinemesis = ranked_played_against[-1] if len(ranked_played_against) > 0 else None
+            if game.ffa: continue # Free-for-all games aren't tracked in the player stats
+            for name in roster.aliases_of(self.index):
+                for match in storage.for_player(analytics.db.table(game.name), name):
+                    self.apply(match)
+        self.rank()
 
     def __str__(self) -> str:
         return self.name
+def sync_roster():
+    '''
+    Brings the players and their stats in line with the roster after it
+    changed. New players start out with no stats and renamed ones keep
+    theirs. See analytics.update_roster(), which also updates what's shown.
+    '''
+    for id, name in enumerate(roster.names):
+        for alias in roster.aliases_of(id)[1:]:
+            ratings.rename(alias, name)
+        ratings.player_index(name)
+    del players[len(roster):]
+    pairs.grow(len(roster))
+    players.extend(Player(id) for id in range(len(players), len(roster)))
+    players_by_name.clear()
+    players_by_name.update({name: players[id] for name, id in roster.ids.items()})
+    player_names[:] = roster.active_names
+
+
 # Define players
-players = [Player(name) for name in player_names]
+roster = Roster(default_names)
+player_names = roster.active_names # The players offered in the dropdowns
+pairs = PairCounts(len(roster))
+ratings = Ratings(roster.names)
+players = [Player(id) for id in range(len(roster))]
+players_by_name = {} # Any name a player went by -> Player
+sync_roster()
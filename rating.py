@@ -0,0 +1,193 @@
+'''
+Elo ratings for the team games, so that beating strong players counts
+for more than beating weak ones. Every player has a rating per game, and
+in Doubles/Triples the rating of a team is the average of its players.
+Every pairing that has played together also gets a rating of its own.
+
+Ratings only depend on the order the matches were played in, so they
+can be updated one match at a time as they are submitted, or replayed
+from scratch over the whole history (e.g. after changing K).
+'''
+
+import numpy as np
+
+import columnar
+from game import team_games
+
+
+class Ratings:
+    '''
+    The Elo ratings of every player and team in every team game. Player
+    ratings are kept in a (games, players) array indexed by the position
+    of the game in `team_games` and the index of the player in `index`.
+    '''
+    BASE = 1500  # Rating everyone starts with
+    SCALE = 400  # Rating difference at which the stronger side is 10x as likely to win
+
+    def __init__(self, names, k=32) -> None:
+        self.k = k # How many points a single match can move a rating by
+        self.games = {game.name: i for i, game in enumerate(team_games)}
+        self.aliases = {} # Old name of a renamed player -> the name they go by now
+        self.resize(names)
+
+    def resize(self, names):
+        '''
+        Forgets every rating and starts over with the given roster.
+        '''
+        self.index = {name: i for i, name in enumerate(names)}
+        self.names = list(names)
+        self.players = np.full((len(self.games), len(names)), float(Ratings.BASE))
+        self.teams = {game: {} for game in self.games} # Game -> sorted tuple of player indices -> rating
+
+    def reset(self):
+        self.resize(self.names)
+
+    def rename(self, old, new):
+        '''
+        Moves the ratings of `old` over to `new`. Matches that still have
+        the old name count for the new one from now on.
+        '''
+        if self.aliases.get(old) == new:
+            return
+        self.aliases.pop(new, None) # In case they are going back to an old name
+        for alias, name in self.aliases.items():
+            if name == old:
+                self.aliases[alias] = new
+        self.aliases[old] = new
+        if old in self.index:
+            i = self.index.pop(old)
+            self.index[new] = i
+            self.names[i] = new
+
+    def renamed(self, matches):
+        '''
+        `matches` with the old names of renamed players swapped for the
+        current ones. Only the matches that need it are copied.
+        '''
+        if not self.aliases:
+            return matches
+        current = lambda team: [self.aliases.get(name, name) for name in team]
+        return [
+            dict(match, team1=current(match['team1']), team2=current(match['team2']))
+            if any(name in self.aliases for name in match['team1'] + match['team2']) else match
+            for match in matches
+        ]
+
+    def player_index(self, name):
+        '''
+        Returns the index of a player, making room for them if they
+        aren't on the roster (e.g. when replaying an old season).
+        '''
+        name = self.aliases.get(name, name)
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.players = np.pad(self.players, ((0, 0), (0, 1)), constant_values=Ratings.BASE)
+        return self.index[name]
+
+    def expected(self, rating, other):
+        '''
+        The chance that a side rated `rating` beats one rated `other`.
+        '''
+        return 1 / (1 + 10 ** ((other - rating) / Ratings.SCALE))
+
+    def apply(self, match):
+        '''
+        Updates the ratings with a newly played match. Team 1 is the winner.
+        '''
+        if match.get('ffa') or match['game'] not in self.games:
+            return
+        team1 = [self.player_index(name) for name in match['team1']]
+        team2 = [self.player_index(name) for name in match['team2']]
+        ratings = self.players[self.games[match['game']]]
+        delta = self.k * (1 - self.expected(ratings[team1].mean(), ratings[team2].mean()))
+        ratings[team1] += delta
+        ratings[team2] -= delta
+
+        teams = self.teams[match['game']]
+        if len(team1) > 1:
+            winners, losers = tuple(sorted(team1)), tuple(sorted(team2))
+            winner, loser = teams.get(winners, Ratings.BASE), teams.get(losers, Ratings.BASE)
+            delta = self.k * (1 - self.expected(winner, loser))
+            teams[winners] = winner + delta
+            teams[losers] = loser - delta
+
+    def replay(self, tables):
+        '''
+        Recomputes every rating from the match history, given as the list
+        of match documents of each game keyed by game name. Matches are
+        sorted by date (keeping the order they were inserted in for matches
+        on the same date) and fed through a tight loop over plain Python
+        lists, which gets through about a million matches per second.
+        '''
+        self.reset()
+        index = dict(self.index)
+        columns = [
+            columnar.ColumnarTable.from_matches(game, self.renamed(tables.get(game.name, [])), index)
+            for game in team_games
+        ]
+        for name in sorted(index, key=index.get)[len(self.names):]:
+            self.player_index(name)
+        for table in columns:
+            order = np.argsort(table.timestamp, kind='stable')
+            self.replay_table(table.game.name, table.team1[order], table.team2[order])
+
+    def replay_table(self, game, team1, team2):
+        row = self.games[game]
+        ratings = self.players[row].tolist()
+        k, scale = self.k, Ratings.SCALE
+        size = team1.shape[1]
+
+        if size == 1:
+            for winner, loser in zip(team1[:, 0].tolist(), team2[:, 0].tolist()):
+                delta = k / (1 + 10 ** ((ratings[winner] - ratings[loser]) / scale))
+                ratings[winner] += delta
+                ratings[loser] -= delta
+            self.players[row] = ratings
+            return
+
+        # Number the teams up front so that the loop doesn't have to. A team
+        # is identified by its sorted player indices read as a base-P number.
+        members = np.sort(np.concatenate([team1, team2]), axis=1)
+        keys = members @ (len(self.names) ** np.arange(size - 1, -1, -1, dtype=np.int64))
+        _, first, ids = np.unique(keys, return_index=True, return_inverse=True)
+        ids = ids.tolist()
+        team_ratings = [float(Ratings.BASE)] * len(first)
+
+        # Going column by column avoids building a list per team
+        columns = [column.tolist() for column in team1.T] + [column.tolist() for column in team2.T]
+        scale *= size # Team ratings are averages, but only the sums are worked out below
+        for match in zip(*columns, ids[:len(team1)], ids[len(team1):]):
+            winners, losers = match[:size], match[size:-2]
+            difference = sum([ratings[p] for p in winners]) - sum([ratings[p] for p in losers])
+            delta = k / (1 + 10 ** (difference / scale))
+            for p in winners:
+                ratings[p] += delta
+            for p in losers:
+                ratings[p] -= delta
+
+            winner, loser = match[-2:]
+            delta = k / (1 + 10 ** ((team_ratings[winner] - team_ratings[loser]) / Ratings.SCALE))
+            team_ratings[winner] += delta
+            team_ratings[loser] -= delta
+
+        self.players[row] = ratings
+        self.teams[game] = dict(zip(map(tuple, members[first].tolist()), team_ratings))
+
+    def of(self, name):
+        '''
+        The ratings of a player, keyed by game.
+        '''
+        i = self.index[self.aliases.get(name, name)]
+        return {game: round(self.players[row, i]) for game, row in self.games.items()}
+
+    def top_teams(self, count):
+        '''
+        The best rated teams across Doubles/Triples as (game, names, rating)
+        tuples, best first.
+        '''
+        teams = [
+            (game, [self.names[p] for p in team], round(rating))
+            for game, ratings in self.teams.items() for team, rating in ratings.items()
+        ]
+        return sorted(teams, key=lambda team: team[2], reverse=True)[:count]
@@ -0,0 +1,62 @@
+'''
+Per-player per-day wins and losses in the team games, for charting how
+win rates evolve over time without going back through every match. The
+rollup is filled in once when the stats are rebuilt and then kept up to
+date one match at a time as they are submitted.
+'''
+
+from bisect import bisect_left
+
+import numpy as np
+
+
+class DailyRollup:
+    '''
+    The wins and losses of every player on every day anyone played, as a
+    (days, players, 2) array. Days are "%Y-%m-%d" strings kept in order,
+    players are numbered by their index in the roster.
+    '''
+
+    def __init__(self, players) -> None:
+        self.reset(players)
+
+    def reset(self, players):
+        self.days = []
+        self.counts = np.zeros((0, players, 2), dtype=np.int32)
+
+    def grow(self, players):
+        '''
+        Makes room for players added to the roster since.
+        '''
+        extra = players - self.counts.shape[1]
+        if extra > 0:
+            self.counts = np.pad(self.counts, ((0, 0), (0, extra), (0, 0)))
+
+    def add(self, match, players):
+        '''
+        Counts a team match. `players` maps names to players (anything with
+        an `index`), names that aren't in it are left out.
+        '''
+        if match.get('ffa'):
+            return
+        day = match['date'][:10]
+        row = bisect_left(self.days, day)
+        if row == len(self.days) or self.days[row] != day:
+            self.days.insert(row, day)
+            self.counts = np.insert(self.counts, row, 0, axis=0)
+        for column, team in ((0, 'team1'), (1, 'team2')):
+            for name in match[team]:
+                if name in players:
+                    self.counts[row, players[name].index, column] += 1
+
+    def win_rates(self):
+        '''
+        The cumulative win rate (in percent) of every player at the end of
+        every day, as a (players, days) array. Days before a player's first
+        match are NaN.
+        '''
+        totals = np.cumsum(self.counts, axis=0)
+        wins, matches = totals[:, :, 0], totals.sum(axis=2)
+        rates = np.full(wins.shape, np.nan)
+        np.divide(wins * 100, matches, out=rates, where=matches > 0)
+        return rates.T
@@ -0,0 +1,116 @@
+'''
+The roster of everyone that plays. Every player gets an integer id when
+they're added, which is what the stats use internally (the rows of the
+pair matrices, the columns of the daily rollup), and names are only
+looked up from it when something is shown. Ids are never reused, so
+players that left are deactivated rather than removed.
+
+Matches store the names of the players as they were when the match was
+played, so a renamed player keeps their old names as aliases and those
+matches still count for them. The roster is kept in `players_file` (see
+default.cfg), and until it exists it's the list in player.py:
+
+    {"players": [{"name": "Adams", "aliases": [], "active": true}, ...]}
+'''
+
+import json
+import os
+
+from seasons import write_json
+
+
+class Roster:
+
+    def __init__(self, names=()) -> None:
+        self.path = None
+        self.reset(names)
+
+    def reset(self, names):
+        self.entries = [] # Id -> {'name', 'aliases', 'active'}
+        self.ids = {}     # Every name anyone went by -> their id
+        for name in names:
+            self.add(name)
+
+    def load(self, path):
+        '''
+        Reads the roster from `path`, if it's there. Otherwise the current
+        roster is kept and written there on the first change.
+        '''
+        self.path = path
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.restore(json.load(f)['players'])
+
+    def restore(self, entries):
+        self.entries = [dict(entry, aliases=list(entry['aliases'])) for entry in entries]
+        self.ids = {}
+        for id, entry in enumerate(self.entries):
+            for name in [entry['name']] + entry['aliases']:
+                self.ids[name] = id
+
+    def save(self):
+        if self.path is not None:
+            write_json(self.path, {'players': self.entries})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def id_of(self, name):
+        return self.ids.get(name)
+
+    def name_of(self, id):
+        return self.entries[id]['name']
+
+    def aliases_of(self, id):
+        '''
+        Every name a player went by, current one first.
+        '''
+        return [self.entries[id]['name']] + self.entries[id]['aliases']
+
+    @property
+    def names(self):
+        '''
+        The current name of every player, by id.
+        '''
+        return [entry['name'] for entry in self.entries]
+
+    @property
+    def active_names(self):
+        '''
+        The players that can be picked for a new match, in alphabetical order.
+        '''
+        return sorted(entry['name'] for entry in self.entries if entry['active'])
+
+    def add(self, name):
+        '''
+        Adds a player and returns their id.
+        '''
+        if not name or name in self.ids:
+            raise ValueError(f'The name {name!r} is already taken')
+        self.ids[name] = len(self.entries)
+        self.entries.append({'name': name, 'aliases': [], 'active': True})
+        return self.ids[name]
+
+    def rename(self, name, new_name):
+        id = self.lookup(name)
+        if new_name in self.ids and self.ids[new_name] != id:
+            raise ValueError(f'The name {new_name!r} is already taken')
+        entry = self.entries[id]
+        if new_name == entry['name']:
+            return id
+        if new_name in entry['aliases']: # Going back to an old name
+            entry['aliases'].remove(new_name)
+        entry['aliases'].append(entry['name'])
+        entry['name'] = new_name
+        self.ids[new_name] = id
+        return id
+
+    def set_active(self, name, active):
+        id = self.lookup(name)
+        self.entries[id]['active'] = active
+        return id
+
+    def lookup(self, name):
+        if name not in self.ids:
+            raise ValueError(f'There is no player called {name!r}')
+        return self.ids[name]
@@ -0,0 +1,191 @@
+'''
+Past seasons, kept as read-only segments next to the current database.
+The current season is whatever `db_file` points at and is the only one
+that gets written to. Every past season is a plain TinyDB JSON file plus
+a `.stats.json` file next to it with the totals of every player in that
+season, and `data/seasons.json` lists them oldest first:
+
+    {"seasons": [{"name": "Season 7.6", "path": "data/season-7.6.json"}, ...]}
+
+Looking at a past season (or at everyone's all-time totals) only reads
+the totals files. The matches of a season are only loaded when its
+totals have to be worked out, which happens once when it's archived.
+See split_db.py to archive the current season.
+'''
+
+import json
+import os
+
+from tinydb import TinyDB
+
+import columnar
+from game import games
+
+# The per-player totals kept for each season, like the fields of Player
+stat_fields = ['wins', 'losses', 'matches', 'perfects']
+game_fields = ['wins', 'losses', 'matches', 'points', 'point_difference']
+
+
+def empty_totals():
+    return {
+        **{field: 0 for field in stat_fields},
+        'games': {game.name: {field: 0 for field in game_fields} for game in games},
+    }
+
+
+def add_totals(total, other):
+    '''
+    Adds the totals of a player in `other` to the ones in `total`.
+    '''
+    for field in stat_fields:
+        total[field] += other[field]
+    for game, stats in other['games'].items():
+        game_total = total['games'].setdefault(game, {field: 0 for field in game_fields})
+        for field in game_fields:
+            game_total[field] += stats[field]
+    return total
+
+
+def season_totals(db):
+    '''
+    Works out the totals of every player that played in `db`, keyed by name.
+    '''
+    return totals_of({game.name: db.table(game.name).all() for game in games})
+
+
+def totals_of(tables):
+    '''
+    Works out the totals of every player in the given matches (a list
+    of matches per game name), keyed by name.
+    '''
+    store = columnar.ColumnarStore.from_tables(tables)
+    result = store.totals()
+    totals = {}
+    for i, name in enumerate(store.names):
+        player = empty_totals()
+        for field in stat_fields:
+            player[field] = int(result[field][i])
+        for game, stats in result['games'].items():
+            player['games'][game] = {field: stats[field][i].item() for field in game_fields}
+        totals[name] = player
+    return totals
+
+
+def write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class Segment:
+    '''
+    A single past season. Nothing is read from disk until it's needed.
+    '''
+
+    def __init__(self, name, path) -> None:
+        self.name = name
+        self.path = path
+        self.stats_path = os.path.splitext(path)[0] + '.stats.json'
+        self._totals = None
+
+    def open(self):
+        return TinyDB(self.path, access_mode='r')
+
+    @property
+    def totals(self):
+        '''
+        The totals of every player in this season, from the `.stats.json`
+        file. They are worked out from the matches (and saved) if the file
+        is missing.
+        '''
+        if self._totals is None:
+            if os.path.isfile(self.stats_path):
+                with open(self.stats_path) as f:
+                    self._totals = json.load(f)
+            else:
+                db = self.open()
+                self._totals = season_totals(db)
+                db.close()
+                write_json(self.stats_path, self._totals)
+        return self._totals
+
+
+class Seasons:
+    '''
+    The list of past seasons, as read from the seasons file.
+    '''
+
+    def __init__(self) -> None:
+        self.path = None
+        self.segments = []
+
+    def load(self, path):
+        self.path = path
+        self.segments = []
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.segments = [Segment(s['name'], s['path']) for s in json.load(f)['seasons']]
+
+    def save(self):
+        write_json(self.path, {'seasons': [{'name': s.name, 'path': s.path} for s in self.segments]})
+
+    @property
+    def names(self):
+        return [segment.name for segment in self.segments]
+
+    def get(self, name):
+        for segment in self.segments:
+            if segment.name == name:
+                return segment
+        return None
+
+    def career(self, *names):
+        '''
+        The totals of a player over every past season, under any of `names`.
+        '''
+        total = empty_totals()
+        for segment in self.segments:
+            for name in names:
+                if name in segment.totals:
+                    add_totals(total, segment.totals[name])
+        return total
+
+    def players(self):
+        '''
+        Everyone that played in a past season, in order of appearance.
+        '''
+        return list(dict.fromkeys(name for segment in self.segments for name in segment.totals))
+
+    def archive(self, db, name, path, before):
+        '''
+        Moves every match played before `before` ("%Y-%m-%d") out of the
+        current database `db` into a new read-only season at `path`.
+        Returns the number of matches moved.
+        '''
+        if self.get(name) is not None:
+            raise ValueError(f'There already is a season called {name}')
+        if os.path.exists(path):
+            raise ValueError(f'{path} already exists')
+
+        moved = {}
+        for game in games:
+            table = db.table(game.name)
+            matches = [match for match in table.all() if match['date'] < before]
+            moved[game.name] = {str(match.doc_id): dict(match) for match in matches}
+        write_json(path, moved)
+
+        segment = Segment(name, path)
+        segment.totals # Worked out now so that it never has to be later
+        self.segments.append(segment)
+        self.save()
+
+        # Only take them out of the current season once the segment is safe
+        for game in games:
+            doc_ids = [int(doc_id) for doc_id in moved[game.name]]
+            if doc_ids:
+                db.table(game.name).remove(doc_ids=doc_ids)
+        return sum(len(matches) for matches in moved.values())
+
+
+past_seasons = Seasons() # Loaded by server.py from `seasons_file` in the config
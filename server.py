@@ -3,18 +3,25 @@ This is the main file. Run this to start the server.
 '''
 
 import configparser
+import json
 import os
 import sys
 
 import analytics
+import metrics
 
 from collections import namedtuple
-from nicegui import ui, app
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse
+from nicegui import ui, app, Client
 
-from player import players, player_names
-from game import games, team_games, ffa_games
+from player import ratings, roster
+from game import games, team_games, ffa_games, get_game
 from time import time
 from form import Form
+from hub import hub, Dashboard
+from seasons import past_seasons
+from writer import submissions
 
 'classes',
 'client',
@@ -42,34 +49,115 @@ config_parser = configparser.ConfigParser()
 config_parser.read(sys.argv[1])
 config = config_parser['topspin']
 
-def refresh_charts():
+@app.get('/api/logs/{game}')
+async def log_page(game: str, start: int = 0, end: int = analytics.LOG_PAGE_SIZE, sort: str = '[]', filter: str = '{}'):
     '''
-    Refreshes the data in all the charts, tables, and player stat cards.
+    Serves a page of the match history to the Logs grids. Async so that
+    it runs on the event loop like the submission writer, and never in
+    the middle of an update to a log index (or on another thread than
+    the SQLite connection expects).
     '''
-    for player in players:
-        player.refresh()
+    if get_game(game) is None:
+        raise HTTPException(status_code=404, detail=f'Unknown game: {game}')
+    end = min(end, start + 10 * analytics.LOG_PAGE_SIZE)
+    rows, total = analytics.query_logs(game, start, end, json.loads(sort), json.loads(filter))
+    return {'rows': rows, 'total': total}
+
+@app.post('/api/rebuild')
+async def rebuild_stats():
+    '''
+    Rebuilds the stats from the database in the background, e.g. after
+    matches were fixed up by hand. Returns once the new stats are live.
+    '''
+    await analytics.rebuild_in_background()
+    hub.refresh_charts([game.name for game in games])
+    return {'version': analytics.stats_version}
 
-    # for chart, update_func in page.charts:
-    #     before = (chart.options['series'])
-    #     chart.options['series'], chart.options['xAxis']['categories'] = update_func()
-    #     after = (chart.options['series'])
+async def catch_up():
+    '''
+    Folds the matches inserted since the last stats checkpoint into the
+    stats once the server is up, see analytics.compute_stats().
+    '''
+    await analytics.rebuild_in_background(full=False)
+    hub.refresh_charts([game.name for game in games])
 
-    #     if before != after:
-    #         print(before, ('-' * 100) + '\n', after, '=' * 100)
+@app.post('/api/players')
+async def add_player(name: str):
+    '''
+    Adds a player to the roster. They show up in the dropdowns of pages
+    loaded from now on.
+    '''
+    return {'id': await roster_change(roster.add, name)}
+
+@app.post('/api/players/{name}/rename')
+async def rename_player(name: str, to: str):
+    return {'id': await roster_change(roster.rename, name, to)}
+
+@app.post('/api/players/{name}/deactivate')
+async def deactivate_player(name: str):
+    '''
+    Takes a player out of the dropdowns. Their stats stay around.
+    '''
+    return {'id': await roster_change(roster.set_active, name, False)}
+
+@app.post('/api/players/{name}/activate')
+async def activate_player(name: str):
+    return {'id': await roster_change(roster.set_active, name, True)}
+
+async def roster_change(change, *args):
+    try:
+        id = await analytics.change_roster(change, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    hub.refresh_charts()
+    return id
+
+@app.get('/metrics')
+async def metrics_page(format: str = 'prometheus'):
+    '''
+    Serves the timings and counters from metrics.py, in the Prometheus text
+    format or as JSON with `?format=json`. Async for the same reason as
+    log_page(), as the gauges read the log indexes.
+    '''
+    if format == 'json':
+        return metrics.as_json()
+    return PlainTextResponse(metrics.as_prometheus())
+
+@metrics.gauge('db_bytes')
+def db_bytes():
+    path = config.get("db_file") or "data/database.json"
+    paths = [path, os.path.splitext(path)[0] + '.json'] if path.endswith('.jsonl') else [path]
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+@metrics.gauge('matches', label='game')
+def match_counts():
+    '''
+    Only counts the games whose log index is built already, building one
+    means loading the whole history of the game.
+    '''
+    return {game: len(index) for game, index in analytics.log_indexes.items()}
 
-    for chart, update_func in page.charts:
-        chart.update()
+@metrics.gauge('connected_clients')
+def connected_clients():
+    hub.prune()
+    return len(hub.dashboards)
 
-    for i, log in enumerate(page.logs):
-        log.options['rowData'] = analytics.db.table(games[i].name).all()
-        log.update()
+@metrics.gauge('queued_submissions')
+def queued_submissions():
+    return len(submissions)
 
 @ui.page("/")
-def main_page():
+def main_page(client: Client):
     '''
     Renders the main page. This is the page that everyone is first
-    routed to, and currently the only page.
+    routed to, and currently the only page. The charts and tables end
+    up in the hub so that submissions from anyone update them.
     '''
+    metrics.count('page_loads')
+    with metrics.timed('page_build'):
+        build_page(client)
+
+def build_page(client):
     ui.colors(primary='#2a9d8f', secondary='#e9c46a', accent='#e76f51', info='#264653')
     ui.header()
     with ui.tabs() as tabs:
@@ -79,38 +167,44 @@ def main_page():
         ui.tab('Add', icon='note_add')
         # ui.tab('Perfects', icon='star')
 
-    for player in players:
-        player.refresh() # Make sure player stats are up-to-date with the DB
-
     panel_classes = 'gap w-full'
     # refresh_btn_classes = 'mt-10 bg-blue-400'
     with ui.tab_panels(tabs, value='Graphs').classes('w-full'):
         with ui.tab_panel('Graphs'):
             with ui.card().classes('w-full'):
-                page.charts = analytics.render_charts()
+                charts = analytics.render_charts()
                 # ui.button('Refresh', on_click=refresh_charts).classes('w-full').classes(refresh_btn_classes)
         with ui.tab_panel('Players'):
             with ui.card().classes('w-full'):
-                page.charts += analytics.stats()
+                player_panels = analytics.stats()
                 # ui.button('Refresh', on_click=refresh_charts).classes('w-full').classes(refresh_btn_classes)
         with ui.tab_panel('Logs'):
             with ui.card().classes('w-full'):
-                page.logs = analytics.logs()
+                logs = analytics.logs()
                 # ui.button('Refresh', on_click=refresh_charts).classes('w-full').classes(refresh_btn_classes)
         with ui.tab_panel('Add'):
             with ui.card().classes('w-full'):
                 with ui.column().classes(panel_classes):
-                    Form(page).render()
+                    Form().render()
 
+    hub.subscribe(Dashboard(client, charts, player_panels, logs))
 
-if __name__ in {"__main__", "__mp_main__"}:
-    analytics.load_db(config.get("db_file") or "data/database.json")
 
-    class Page(): pass
-    page = Page()
-    page.refresh_charts = refresh_charts
+if __name__ in {"__main__", "__mp_main__"}:
+    ratings.k = float(config.get("rating_k") or 32)
+    past_seasons.load(config.get("seasons_file") or "data/seasons.json")
+    roster.load(config.get("players_file") or "data/players.json")
+    analytics.update_roster()
+    # The stats start out from the last checkpoint, if there is one, and
+    # get caught up in a worker process once the server is up
+    analytics.open_db(config.get("db_file") or "data/database.json")
+    analytics.load_checkpoint()
 
     app.root_path = config.get("root_path") or "/"
+    app.on_startup(metrics.watch_loop)
+    app.on_startup(catch_up)
+    app.on_startup(submissions.run)
+    app.on_shutdown(submissions.flush)
 
     ui.run(
         title="TopSpin",
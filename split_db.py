@@ -1,28 +1,35 @@
-import json
-from datetime import datetime
-from rich import print
+'''
+Ends a season: every match played before the given date is moved out of
+the current database into a read-only season file, and the season is
+added to the seasons file (see seasons.py). Stop the server first.
 
-with open('data/database.json', 'r') as f:
-    data = json.load(f)
-old_season = {}
-new_season = {}
+    python split_db.py <config file> <season name> <YYYY-MM-DD>
 
-split_date = datetime(2024, 4, 1)
+e.g. `python split_db.py default.cfg "Season 7.7" 2024-09-01` moves
+everything before September 2024 into data/season-7.7.json.
+'''
 
-for gamemode, matches in data.items():
-    old_season[gamemode] = {}
-    new_season[gamemode] = {}
-    for index, match in matches.items():
-        date = datetime.strptime(match['date'], '%Y-%m-%d %H:%M:%S')
-        # if the date is before April 2024, it's in the previous season, pop it
-        if date >= split_date:
-            new_season[gamemode][str(len(new_season[gamemode]))] = match
-        else:
-            old_season[gamemode][str(len(old_season[gamemode]))] = match
+import configparser
+import os
+import sys
 
-print(old_season)
+import storage
+from seasons import past_seasons
 
-json.dump(old_season, open('data/season-7.6.json', 'w'))
-json.dump(new_season, open('data/season-7.7.json', 'w'))
+if len(sys.argv) != 4:
+    print(__doc__)
+    sys.exit(1)
 
+config_parser = configparser.ConfigParser()
+config_parser.read(sys.argv[1])
+config = config_parser['topspin']
+name, before = sys.argv[2], sys.argv[3]
 
+db_file = config.get('db_file') or 'data/database.json'
+past_seasons.load(config.get('seasons_file') or 'data/seasons.json')
+path = os.path.join(os.path.dirname(db_file), 'season-' + name.lower().replace('season', '').strip().replace(' ', '-') + '.json')
+
+db = storage.open_db(db_file)
+moved = past_seasons.archive(db, name, path, before)
+db.close()
+print(f'Moved {moved} matches played before {before} into {path}')
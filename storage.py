@@ -0,0 +1,410 @@
+'''
+Storage backends for the match database. The default TinyDB JSON
+storage rewrites the whole file on every insert, which gets slower the
+more matches we record, so this module also offers an append-only log.
+The backend is picked from the extension of `db_file` in the config.
+
+Whatever the backend, `db.table(game.name)` hands back something with
+the `all()`/`insert()`/`get()`/`update()`/`remove()` methods of a TinyDB
+table. Use `for_player()` below to find the matches of a player, which
+the SQLite backend can answer from an index. Filtering by date is done
+in memory by the log indexes (see match_index.py) whatever the backend.
+'''
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from tinydb import TinyDB, Query
+from tinydb.storages import Storage, touch
+from tinydb.table import Document, Table
+
+# Held while the submission writer (see writer.py) inserts matches from its
+# worker thread. Anything else reading the tables while the server runs
+# takes it too, so it never sees a half-written file.
+write_lock = threading.Lock()
+
+
+class AppendLogStorage(Storage):
+    '''
+    Stores the database as a snapshot in the usual per-game JSON layout
+    plus a line-delimited log of every document that changed since the
+    snapshot was written. Writes only append to the log; once enough
+    lines have piled up the log is compacted back into the snapshot.
+
+    For `data/database.jsonl` the snapshot lives at `data/database.json`,
+    so an existing database can be switched over by just changing the
+    extension of `db_file`.
+    '''
+    COMPACT_EVERY = 200 # Log lines to collect before folding them into the snapshot
+
+    def __init__(self, path, create_dirs=False, encoding=None):
+        super().__init__()
+        self.log_path = path
+        self.snapshot_path = os.path.splitext(path)[0] + '.json'
+        self.encoding = encoding
+        self.tables = None # The state of the database as it is on disk
+        self.entries = 0   # Number of lines in the log
+
+        touch(self.log_path, create_dirs=create_dirs)
+        self._handle = open(self.log_path, mode='a', encoding=encoding)
+
+    def load(self):
+        '''
+        Loads the snapshot and replays the log on top of it.
+        '''
+        self.tables = {}
+        if os.path.isfile(self.snapshot_path) and os.path.getsize(self.snapshot_path):
+            with open(self.snapshot_path, encoding=self.encoding) as f:
+                self.tables = json.load(f)
+
+        self.entries = 0
+        with open(self.log_path, encoding=self.encoding) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                self.replay(json.loads(line))
+                self.entries += 1
+
+    def replay(self, entry):
+        if entry['id'] is None: # The whole table was dropped
+            self.tables.pop(entry['table'], None)
+            return
+        table = self.tables.setdefault(entry['table'], {})
+        if entry['doc'] is None:
+            table.pop(entry['id'], None)
+        else:
+            table[entry['id']] = entry['doc']
+
+    def read(self):
+        if self.tables is None:
+            self.load()
+        if not self.tables and not self.entries:
+            return None # Let TinyDB initialize an empty database
+
+        # TinyDB modifies what we hand it before passing it back to write(),
+        # so give it copies to be able to tell what changed.
+        return {
+            name: {doc_id: dict(doc) for doc_id, doc in table.items()}
+            for name, table in self.tables.items()
+        }
+
+    def write(self, data):
+        if self.tables is None:
+            self.load()
+
+        lines = []
+        for name, table in data.items():
+            old_table = self.tables.get(name, {})
+            for doc_id, doc in table.items():
+                if old_table.get(doc_id) != doc:
+                    lines.append({'table': name, 'id': doc_id, 'doc': doc})
+            for doc_id in old_table.keys() - table.keys():
+                lines.append({'table': name, 'id': doc_id, 'doc': None})
+            if name not in self.tables:
+                self.tables[name] = {}
+        for name in self.tables.keys() - data.keys():
+            lines.append({'table': name, 'id': None, 'doc': None})
+
+        self.append(lines)
+
+    def table(self, name):
+        '''
+        The documents of a table as they are on disk, keyed by doc id (as a
+        string). Not a copy, so don't modify it.
+        '''
+        if self.tables is None:
+            self.load()
+        return self.tables.get(name, {})
+
+    def append(self, lines):
+        '''
+        Appends the given changes to the log and applies them.
+        '''
+        if not lines:
+            return
+
+        self._handle.write(''.join(json.dumps(line) + '\n' for line in lines))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        for line in lines:
+            self.replay(line)
+        self.entries += len(lines)
+
+        if self.entries >= AppendLogStorage.COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        '''
+        Writes the current state into the snapshot file and empties the log.
+        The snapshot is replaced atomically, and replaying the log again on
+        top of it is harmless, so a crash in between doesn't lose matches.
+        '''
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding=self.encoding) as f:
+            json.dump(self.tables, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        self._handle.seek(0)
+        self._handle.truncate()
+        self.entries = 0
+
+    def close(self):
+        if self.tables is not None and self.entries:
+            self.compact()
+        self._handle.close()
+
+
+class AppendLogTable(Table):
+    '''
+    A table of a database kept in an `AppendLogStorage`. Inserting goes
+    straight to the end of the log instead of through TinyDB's usual
+    read-modify-write, which copies and compares every document in the
+    database to find the one that was added. That way an insert costs the
+    same however many matches there are (apart from the occasional
+    compaction). Everything else works like a normal TinyDB table.
+    '''
+
+    def insert(self, document):
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents):
+        table = self.storage.table(self.name)
+        doc_ids = []
+        lines = []
+        for document in documents:
+            if not isinstance(document, Mapping):
+                raise ValueError('Document is not a Mapping')
+            if isinstance(document, Document):
+                doc_id = document.doc_id
+                self._next_id = None # Worked out again on the next insert
+            else:
+                doc_id = self._get_next_id()
+            if str(doc_id) in table or doc_id in doc_ids:
+                raise ValueError(f'Document with ID {doc_id} already exists')
+            doc_ids.append(doc_id)
+            lines.append({'table': self.name, 'id': str(doc_id), 'doc': dict(document)})
+        self.storage.append(lines)
+        self.clear_cache()
+        return doc_ids
+
+    def _get_next_id(self):
+        if self._next_id is None:
+            self._next_id = max(map(int, self.storage.table(self.name)), default=0) + 1
+        next_id = self._next_id
+        self._next_id += 1
+        return next_id
+
+
+class AppendLogDB(TinyDB):
+    table_class = AppendLogTable
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    game TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    ffa INTEGER NOT NULL,
+    score1 REAL,
+    score2 REAL,
+    winner TEXT,
+    lives REAL,
+    UNIQUE (game, doc_id)
+);
+CREATE TABLE IF NOT EXISTS participants (
+    match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+    player TEXT NOT NULL,
+    game TEXT NOT NULL,
+    side INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS participants_player_game ON participants (player, game);
+CREATE INDEX IF NOT EXISTS participants_side ON participants (side, player);
+CREATE INDEX IF NOT EXISTS participants_match ON participants (match_id);
+'''
+
+
+class SQLiteDB:
+    '''
+    Stores the matches in SQLite, normalized into a `matches` table and a
+    `participants` table with one row per player per match. Team 1 is
+    side 1 and team 2 is side 2, the winner of a free-for-all is side 1.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # Matches are inserted from a worker thread (see writer.py), which
+        # takes storage.write_lock like everything else that reads the tables
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def table(self, name):
+        return SQLiteTable(self, name)
+
+    def tables(self):
+        return {row[0] for row in self.connection.execute('SELECT DISTINCT game FROM matches')}
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteTable:
+    '''
+    A single game mode in a `SQLiteDB`, mimicking a TinyDB table.
+    '''
+    MATCH_COLUMNS = 'id, doc_id, date, ffa, score1, score2, winner, lives'
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def _documents(self, where='', params=()):
+        '''
+        Fetches the matches selected by `where` along with their players
+        and turns them back into documents shaped like the ones TinyDB stores.
+        '''
+        connection = self.db.connection
+        rows = connection.execute(
+            f'SELECT {SQLiteTable.MATCH_COLUMNS} FROM matches m WHERE m.game = ? {where} ORDER BY m.doc_id',
+            (self.name, *params)
+        ).fetchall()
+        if not rows:
+            return []
+
+        teams = {row[0]: ([], []) for row in rows}
+        for match_id, player, side in connection.execute(
+            f'''SELECT p.match_id, p.player, p.side FROM participants p
+                JOIN matches m ON m.id = p.match_id
+                WHERE m.game = ? {where} ORDER BY p.match_id, p.position''',
+            (self.name, *params)
+        ):
+            teams[match_id][side - 1].append(player)
+
+        documents = []
+        for match_id, doc_id, date, ffa, score1, score2, winner, lives in rows:
+            doc = {'game': self.name, 'date': date, 'ffa': bool(ffa)}
+            if ffa:
+                doc.update({'winner': winner, 'lives': lives})
+            else:
+                team1, team2 = teams[match_id]
+                doc.update({'team1': team1, 'score1': score1, 'team2': team2, 'score2': score2})
+            documents.append(Document(doc, doc_id))
+        return documents
+
+    def all(self):
+        return self._documents()
+
+    def __len__(self):
+        return self.db.connection.execute(
+            'SELECT COUNT(*) FROM matches WHERE game = ?', (self.name,)
+        ).fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def get(self, doc_id):
+        documents = self._documents('AND m.doc_id = ?', (doc_id,))
+        return documents[0] if documents else None
+
+    def search(self, cond):
+        return [doc for doc in self.all() if cond(doc)]
+
+    def for_player(self, name):
+        return self._documents(
+            'AND m.id IN (SELECT match_id FROM participants WHERE player = ? AND game = ?)',
+            (name, self.name)
+        )
+
+    def _insert(self, doc, doc_id):
+        cursor = self.db.connection.execute(
+            '''INSERT INTO matches (game, doc_id, date, ffa, score1, score2, winner, lives)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (self.name, doc_id, doc['date'], int(doc['ffa']),
+             doc.get('score1'), doc.get('score2'), doc.get('winner'), doc.get('lives'))
+        )
+        match_id = cursor.lastrowid
+        if doc['ffa']:
+            sides = [[doc['winner']]]
+        else:
+            sides = [doc['team1'], doc['team2']]
+        self.db.connection.executemany(
+            'INSERT INTO participants (match_id, player, game, side, position) VALUES (?, ?, ?, ?, ?)',
+            [(match_id, player, self.name, side + 1, position)
+                for side, team in enumerate(sides) for position, player in enumerate(team)]
+        )
+
+    def _insert_new(self, doc):
+        doc_id = getattr(doc, 'doc_id', None)
+        if doc_id is None:
+            doc_id = self.db.connection.execute(
+                'SELECT COALESCE(MAX(doc_id), 0) + 1 FROM matches WHERE game = ?', (self.name,)
+            ).fetchone()[0]
+        self._insert(doc, doc_id)
+        return doc_id
+
+    def insert(self, doc):
+        with self.db.connection:
+            return self._insert_new(doc)
+
+    def insert_multiple(self, docs):
+        '''
+        Inserts all of `docs` in one transaction, so either all of them are
+        saved or none are.
+        '''
+        with self.db.connection:
+            return [self._insert_new(doc) for doc in docs]
+
+    def update(self, fields, doc_ids):
+        updated = []
+        with self.db.connection:
+            for doc_id in doc_ids:
+                doc = self.get(doc_id)
+                if doc is None:
+                    continue
+                doc.update(fields)
+                self._delete(doc_id)
+                self._insert(doc, doc_id)
+                updated.append(doc_id)
+        return updated
+
+    def _delete(self, doc_id):
+        self.db.connection.execute(
+            'DELETE FROM matches WHERE game = ? AND doc_id = ?', (self.name, doc_id)
+        )
+
+    def remove(self, doc_ids):
+        with self.db.connection:
+            for doc_id in doc_ids:
+                self._delete(doc_id)
+        return list(doc_ids)
+
+
+def for_player(table, name):
+    '''
+    All the matches in `table` that `name` played in.
+    '''
+    if isinstance(table, SQLiteTable):
+        return table.for_player(name)
+    match = Query()
+    # any() with a list tests membership, with a plain string it would test for a substring
+    return table.search(match.team1.any([name]) | match.team2.any([name]) | (match.winner == name))
+
+
+def open_db(path):
+    '''
+    Opens the database at `path`, picking the storage from its extension.
+    `.jsonl` uses the append-only log, `.sqlite`/`.db` uses SQLite and
+    anything else the plain JSON file.
+    '''
+    if path.endswith(('.sqlite', '.db')):
+        return SQLiteDB(path)
+    if path.endswith('.jsonl'):
+        return AppendLogDB(path, storage=AppendLogStorage)
+    return TinyDB(path)
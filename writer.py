@@ -0,0 +1,116 @@
+'''
+Writes submitted matches to the database in the background. Form.submit()
+only validates a match and puts it on the queue, so the event loop that
+serves every client never waits for the database file to be rewritten.
+A single writer task takes whatever has piled up since its last round,
+inserts it in one go per game on a worker thread, and then updates the
+stats, the log indexes and everyone's charts once for the whole batch.
+'''
+
+import asyncio
+import traceback
+from time import perf_counter
+
+from nicegui import run
+
+import analytics
+import metrics
+import storage
+from hub import hub
+
+RETRY_DELAY = 1 # Seconds to wait before trying a failed write again
+
+
+def insert_batch(batch, doc_ids):
+    '''
+    Inserts the matches of a batch, one call per game so the JSON file is
+    only rewritten once per game. Fills in the doc ids in batch order as
+    it goes, so if a game fails the caller can tell which matches were
+    saved. Runs on a worker thread.
+    '''
+    by_game = {}
+    for i, match in enumerate(batch):
+        by_game.setdefault(match['game'], []).append(i)
+    with storage.write_lock:
+        for game, positions in by_game.items():
+            inserted = analytics.db.table(game).insert_multiple([batch[i] for i in positions])
+            for i, doc_id in zip(positions, inserted):
+                doc_ids[i] = doc_id
+
+
+class SubmissionQueue:
+
+    def __init__(self) -> None:
+        self.queue = asyncio.Queue() # Wakes the writer up
+        self.pending = []            # (match, time queued) pairs not written yet
+
+    def put(self, match):
+        self.pending.append((match, perf_counter()))
+        self.queue.put_nowait(None)
+        metrics.count('submissions')
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def run(self):
+        '''
+        The writer task, started with the server.
+        '''
+        while True:
+            await self.queue.get()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if not self.pending:
+                continue
+            batch, self.pending = self.pending, []
+            failed = []
+            async with analytics.stats_lock: # Not while the stats are being rebuilt
+                doc_ids = [None] * len(batch)
+                try:
+                    with metrics.timed('db_write'):
+                        await run.io_bound(insert_batch, [match for match, _ in batch], doc_ids)
+                except Exception:
+                    traceback.print_exc()
+                    failed = [submission for submission, doc_id in zip(batch, doc_ids) if doc_id is None]
+                saved = [(submission, doc_id) for submission, doc_id in zip(batch, doc_ids) if doc_id is not None]
+                try:
+                    self.apply(saved)
+                except Exception:
+                    # The matches are in the database by now, so they aren't
+                    # written again. POST /api/rebuild catches the stats up.
+                    traceback.print_exc()
+            if failed:
+                self.pending = failed + self.pending # Tried again on the next round
+                await asyncio.sleep(RETRY_DELAY)
+                self.queue.put_nowait(None)
+
+    def apply(self, saved):
+        '''
+        Updates the stats, the log indexes and everyone's charts with the
+        ((match, time queued), doc id) pairs that were just inserted.
+        '''
+        if not saved:
+            return
+        with metrics.timed('stats_update'):
+            for (match, _), _ in saved:
+                analytics.apply_match(match)
+                print(f'Submit {match}')
+        with metrics.timed('log_index_update'):
+            for (match, _), doc_id in saved:
+                analytics.update_log_index(match['game'], {'add': [analytics.log_row(match, doc_id)]})
+        hub.refresh_charts({match['game'] for (match, _), _ in saved})
+        for (_, queued), _ in saved:
+            metrics.observe('submit', perf_counter() - queued)
+        metrics.count('batches')
+
+    def flush(self):
+        '''
+        Writes whatever is still queued without going through the writer
+        task, for when the server shuts down.
+        '''
+        batch, self.pending = self.pending, []
+        if batch:
+            insert_batch([match for match, _ in batch], [None] * len(batch))
+
+
+submissions = SubmissionQueue()